@@ -0,0 +1,65 @@
+"""
+Time of clustering a single object in the "deterministic" and "fast"
+modes of EventDetection, per object size, and the agreement of their
+clusterings (adjusted Rand index). The fast mode lets UMAP and HDBSCAN
+core distances use all cores, so run it on the machine of interest;
+on a single core both modes take about the same time.
+Texts and embeddings are synthetic, so no model is downloaded.
+
+    python benchmarks/fast_mode.py
+"""
+import os
+import time
+import warnings
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+from synthetic import make_object
+
+from factfinder.src.event_detection import _cluster_object
+
+warnings.filterwarnings("ignore")
+
+THEMES = [
+    "яма на дороге",
+    "мусор во дворе",
+    "нет горячей воды",
+    "не горят фонари",
+    "сломана детская площадка",
+    "нет остановки автобуса",
+]
+SIZES = [200, 1000, 3000]
+REPEATS = 2
+MIN_EVENT_SIZE = 3
+
+
+def measure(docs, embeddings, fast):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        _, topics, *_ = _cluster_object(
+            docs, embeddings, MIN_EVENT_SIZE, False, None, None, fast
+        )
+        timings.append(time.perf_counter() - start)
+    return min(timings), topics
+
+
+def main():
+    rng = np.random.default_rng(42)
+    print(f"{os.cpu_count()} cores")
+    print(f"{'size':>5} {'deterministic, s':>17} {'fast, s':>9} {'ARI':>6}")
+    for size in SIZES:
+        docs, embeddings = make_object(size, rng, THEMES)
+        deterministic_time, deterministic_topics = measure(
+            docs, embeddings, False
+        )
+        fast_time, fast_topics = measure(docs, embeddings, True)
+        agreement = adjusted_rand_score(deterministic_topics, fast_topics)
+        print(
+            f"{size:>5} {deterministic_time:>17.3f} {fast_time:>9.3f}"
+            f" {agreement:>6.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
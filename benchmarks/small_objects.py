@@ -0,0 +1,57 @@
+"""
+Latency of clustering a single object with and without the small object
+fast path of EventDetection (see small_object_size), per object size.
+Texts and embeddings are synthetic, so no model is downloaded.
+
+    python benchmarks/small_objects.py
+"""
+import time
+import warnings
+
+import numpy as np
+from synthetic import make_object
+
+from factfinder.src.event_detection import _cluster_object
+
+warnings.filterwarnings("ignore")
+
+THEMES = [
+    "яма на дороге",
+    "мусор во дворе",
+    "нет горячей воды",
+    "не горят фонари",
+]
+SIZES = [5, 10, 15, 20, 30, 50, 100]
+REPEATS = 3
+MIN_EVENT_SIZE = 3
+
+
+def measure(docs, embeddings, small_object_size):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        event_model, *_ = _cluster_object(
+            docs, embeddings, MIN_EVENT_SIZE, False, small_object_size
+        )
+        timings.append(time.perf_counter() - start)
+    n_events = None if event_model is None else len(event_model)
+    return min(timings), n_events
+
+
+def main():
+    rng = np.random.default_rng(42)
+    print(
+        f"{'size':>5} {'umap, s':>9} {'events':>7} {'fast, s':>9} {'events':>7}"
+    )
+    for size in SIZES:
+        docs, embeddings = make_object(size, rng, THEMES)
+        umap_time, umap_events = measure(docs, embeddings, None)
+        fast_time, fast_events = measure(docs, embeddings, size + 1)
+        print(
+            f"{size:>5} {umap_time:>9.3f} {str(umap_events):>7}"
+            f" {fast_time:>9.3f} {str(fast_events):>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+"""
+Synthetic objects for the benchmarks: texts of a few themes with
+embeddings close to one axis per theme, so no model is downloaded.
+"""
+import numpy as np
+
+
+def make_object(size, rng, themes, dimensions=312):
+    docs, embeddings = [], []
+    for i in range(size):
+        theme = i % len(themes)
+        docs.append(f"{themes[theme]} дом {rng.integers(1000)}")
+        vector = rng.normal(0, 0.1, dimensions)
+        vector[theme] += 1
+        embeddings.append(vector / np.linalg.norm(vector))
+    return docs, np.array(embeddings)
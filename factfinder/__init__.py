@@ -1,8 +1,27 @@
-from .src import EventDetection, Geocoder, TextClassifier, TextClassifierTopics
+from .src import (
+    CascadeModel,
+    EventDetection,
+    Geocoder,
+    Instrumentation,
+    MicroBatcher,
+    ModelRegistry,
+    OsmExtract,
+    Pipeline,
+    ShardedRun,
+    TextClassifier,
+    TextClassifierTopics,
+)
 
 __all__ = [
     "EventDetection",
     "TextClassifier",
     "TextClassifierTopics",
     "Geocoder",
+    "CascadeModel",
+    "Instrumentation",
+    "MicroBatcher",
+    "ModelRegistry",
+    "OsmExtract",
+    "Pipeline",
+    "ShardedRun",
 ]
@@ -1,5 +1,12 @@
+from .cascade import CascadeModel
 from .event_detection import EventDetection
 from .geocoder import Geocoder
+from .instrumentation import Instrumentation
+from .model_registry import ModelRegistry
+from .osm import OsmExtract
+from .pipeline import Pipeline
+from .serving import MicroBatcher
+from .sharding import ShardedRun
 from .text_classifier import TextClassifier
 from .text_classifier_topics import TextClassifierTopics
 
@@ -8,4 +15,11 @@ __all__ = [
     "TextClassifier",
     "TextClassifierTopics",
     "Geocoder",
+    "CascadeModel",
+    "Instrumentation",
+    "MicroBatcher",
+    "ModelRegistry",
+    "OsmExtract",
+    "Pipeline",
+    "ShardedRun",
 ]
@@ -0,0 +1,135 @@
+"""
+This module is aimed to classify easy texts with a cheap linear model
+over hashed character n-grams before the transformer. The linear model
+is distilled from the labels the transformer gives on our own texts,
+only texts it is not confident about are passed to the transformer
+(see TextClassifier cascade).
+"""
+import hashlib
+import io
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+
+class CascadeModel:
+    """
+    This class is aimed to fit, persist and apply the cheap first stage
+    of the classification cascade: a logistic regression trained with SGD
+    on hashed character n-grams of texts.
+
+    Args:
+        n_features (int): The number of hashed features.
+        ngram_range (tuple): The range of lengths of character n-grams.
+        alpha (float): The regularization strength of the classifier.
+    """
+
+    def __init__(
+        self,
+        n_features: int = 2**20,
+        ngram_range: tuple = (2, 4),
+        alpha: float = 1e-5,
+    ):
+        self.vectorizer = HashingVectorizer(
+            analyzer="char_wb",
+            ngram_range=ngram_range,
+            n_features=n_features,
+            alternate_sign=False,
+            lowercase=True,
+        )
+        self.classifier = SGDClassifier(
+            loss="log_loss", alpha=alpha, max_iter=50, random_state=42
+        )
+
+    def fit(self, texts: list, labels: list):
+        self.classifier.fit(self.vectorizer.transform(texts), labels)
+        return self
+
+    @classmethod
+    def distill(cls, classifier, texts: list, batch_size: int = 32, **params):
+        """
+        Fit a cascade model on the top categories the transformer
+        classifier (TextClassifier) gives to texts.
+        """
+        texts = [text for text in texts if isinstance(text, str)]
+        labels = [
+            cats.split("; ")[0]
+            for cats, _ in classifier.run_batch(texts, batch_size=batch_size)
+        ]
+        return cls(**params).fit(texts, labels)
+
+    def predict(self, texts: list, top_k: int = 1) -> tuple:
+        """
+        Get the top_k categories of every text with their probabilities,
+        in the format of the transformers text-classification pipeline,
+        and the probability of the top category of every text as float32.
+        """
+        probs = self.classifier.predict_proba(self.vectorizer.transform(texts))
+        order = np.argsort(-probs, axis=1)[:, :top_k]
+        classes = self.classifier.classes_
+        preds = [
+            [
+                {"label": str(classes[j]), "score": float(row_probs[j])}
+                for j in row_order
+            ]
+            for row_order, row_probs in zip(order, probs)
+        ]
+        return preds, probs.max(axis=1).astype(np.float32)
+
+    def coverage_report(
+        self, texts: list, labels: list, thresholds=None
+    ) -> pd.DataFrame:
+        """
+        Get the share of texts the cascade model classifies itself
+        (coverage), its accuracy on them and the accuracy of the whole
+        cascade at every confidence threshold. labels are the reference
+        categories, e.g. given by the transformer, which is counted as
+        right on the texts passed to it.
+        """
+        if thresholds is None:
+            thresholds = np.round(np.arange(0.5, 1.0, 0.05), 2)
+        preds, confidence = self.predict(texts)
+        correct = np.array(
+            [pred[0]["label"] == label for pred, label in zip(preds, labels)]
+        )
+        rows = []
+        for threshold in thresholds:
+            covered = confidence >= threshold
+            rows.append(
+                {
+                    "threshold": threshold,
+                    "coverage": covered.mean(),
+                    "accuracy": correct[covered].mean()
+                    if covered.any()
+                    else np.nan,
+                    "cascade_accuracy": (correct | ~covered).mean(),
+                }
+            )
+        return pd.DataFrame(rows)
+
+    def digest(self) -> str:
+        """
+        Hash the parameters and fitted weights of the model, e.g. to key
+        cached classification outputs (see Pipeline).
+        """
+        buffer = io.BytesIO()
+        joblib.dump(self, buffer)
+        return hashlib.sha1(buffer.getvalue()).hexdigest()
+
+    @staticmethod
+    def file_digest(path: str) -> str:
+        """
+        Hash the file a model is saved to.
+        """
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def save(self, path: str):
+        joblib.dump(self, path)
+
+    @staticmethod
+    def load(path: str) -> "CascadeModel":
+        return joblib.load(path)
@@ -0,0 +1,95 @@
+"""
+This module is aimed to find near-duplicate messages (complaint campaigns,
+reposts) with MinHash signatures of character shingles and locality
+sensitive hashing (LSH). Texts whose signatures share a band are compared
+by the estimated Jaccard similarity of their shingles, similar texts
+are joined into groups.
+"""
+import re
+import zlib
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+# hashes are reduced modulo a Mersenne prime small enough for
+# a * hash + b to fit into uint64
+_PRIME = np.uint64((1 << 31) - 1)
+
+
+def _shingles(text: str, size: int) -> set:
+    text = re.sub(r"\W+", " ", str(text).lower()).strip()
+    if len(text) <= size:
+        return {text}
+    return {text[i : i + size] for i in range(len(text) - size + 1)}
+
+
+def minhash_signatures(
+    texts: list, num_perm: int = 64, shingle_size: int = 5, seed: int = 1
+) -> np.ndarray:
+    """
+    Compute MinHash signatures (texts x num_perm) of the character
+    shingles of texts. Texts are lowercased and stripped of punctuation.
+    """
+    hashes, owners = [], []
+    for i, text in enumerate(texts):
+        shingles = _shingles(text, shingle_size)
+        hashes.extend(zlib.crc32(s.encode("utf-8")) for s in shingles)
+        owners.extend([i] * len(shingles))
+    hashes = np.array(hashes, dtype=np.uint64) % _PRIME
+    starts = np.searchsorted(np.array(owners), np.arange(len(texts)))
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(_PRIME), num_perm).astype(np.uint64)
+    b = rng.integers(0, int(_PRIME), num_perm).astype(np.uint64)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint64)
+    # permutations are applied in chunks to bound memory
+    for first in range(0, num_perm, 8):
+        chunk = slice(first, first + 8)
+        values = (a[chunk, None] * hashes[None, :] + b[chunk, None]) % _PRIME
+        signatures[:, chunk] = np.minimum.reduceat(values, starts, axis=1).T
+    return signatures
+
+
+def near_duplicate_groups(
+    texts: list,
+    threshold: float = 0.8,
+    num_perm: int = 64,
+    bands: int = 16,
+    shingle_size: int = 5,
+) -> np.ndarray:
+    """
+    Group texts whose estimated Jaccard similarity is at least threshold.
+    Returns the group of every text, groups are numbered in the order
+    of their first text.
+    """
+    if len(texts) == 0:
+        return np.array([], dtype=np.int64)
+    signatures = minhash_signatures(texts, num_perm, shingle_size)
+    rows = num_perm // bands
+    pairs = []
+    for band in range(bands):
+        _, buckets = np.unique(
+            signatures[:, band * rows : (band + 1) * rows],
+            axis=0,
+            return_inverse=True,
+        )
+        buckets = buckets.ravel()
+        # every text is compared with the first text of its bucket
+        order = np.argsort(buckets, kind="stable")
+        first = np.r_[True, buckets[order][1:] != buckets[order][:-1]]
+        heads = order[first][np.cumsum(first) - 1]
+        candidates = heads != order
+        pairs.append(np.stack([heads[candidates], order[candidates]], 1))
+    pairs = np.unique(np.concatenate(pairs), axis=0)
+    similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(1)
+    pairs = pairs[similarity >= threshold]
+    graph = sparse.csr_matrix(
+        (np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+        shape=(len(texts), len(texts)),
+    )
+    _, labels = connected_components(graph, directed=False)
+    # renumber groups in the order of their first text
+    _, first_text, inverse = np.unique(
+        labels, return_index=True, return_inverse=True
+    )
+    return np.argsort(np.argsort(first_text))[inverse]
@@ -1,26 +1,539 @@
+import copy
+import hashlib
+import json
+import multiprocessing
+import os
 import re
-from itertools import chain, combinations
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
 import geopandas as gpd
 import osmnx as ox
 import pandas as pd
 import numpy as np
+import shapely
+import bertopic
 from bertopic import BERTopic
+from bertopic.cluster import BaseCluster
+from bertopic.dimensionality import BaseDimensionalityReduction
 from hdbscan import HDBSCAN
-from shapely.geometry import LineString
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.metrics.pairwise import cosine_distances
+from sklearn.preprocessing import normalize
 from transformers.pipelines import pipeline
 from umap import UMAP
 
+from .dedup import near_duplicate_groups
+from .instrumentation import Instrumentation
+from .model_registry import ModelRegistry, default_registry
+from .osm import OsmExtract
+from .storage import read_layer, write_outputs
+
+
+class _RowVectorizer(CountVectorizer):
+    """
+    A CountVectorizer over a fixed vocabulary that does not tokenize.
+    Documents are keys "d<i>" of rows of a precomputed document-term matrix
+    (the rows attribute), a document made of several keys joined by spaces
+    is counted as the sum of their rows.
+    """
+
+    def fit(self, raw_documents, y=None):
+        self._validate_vocabulary()
+        return self
+
+    def fit_transform(self, raw_documents, y=None):
+        return self.fit(raw_documents).transform(raw_documents)
+
+    def transform(self, raw_documents):
+        keys = [
+            (i, int(key[1:]))
+            for i, document in enumerate(raw_documents)
+            for key in document.split()
+        ]
+        documents, rows = np.array(keys, dtype=np.int64).reshape(-1, 2).T
+        selection = sparse.csr_matrix(
+            (np.ones(len(keys), dtype=np.int64), (documents, rows)),
+            shape=(len(raw_documents), self.rows.shape[0]),
+        )
+        return (selection @ self.rows).tocsr()
+
+
+def _similarity_clusters(
+    embeddings: np.ndarray, min_event_size: int
+) -> np.ndarray:
+    """
+    Cluster embeddings with HDBSCAN on their precomputed cosine distances.
+    Used instead of UMAP and HDBSCAN for objects with few texts.
+    """
+    if len(embeddings) < min_event_size:
+        return np.full(len(embeddings), -1)
+    distances = cosine_distances(embeddings).astype(np.float64)
+    clusterer = HDBSCAN(
+        min_cluster_size=min_event_size,
+        min_samples=1,
+        metric="precomputed",
+    )
+    return clusterer.fit_predict(distances)
+
+
+def _stable_topics(topic_info: pd.DataFrame, topics: list) -> dict:
+    """
+    Map topic ids to ids ordered by the number of texts of a topic, then
+    by the position of its first text, so the same clusters get the same
+    ids whatever order the clusterer found them in. Outliers keep -1.
+    """
+    counts = Counter(topics)
+    first = {}
+    for i, topic in enumerate(topics):
+        first.setdefault(topic, i)
+    ordered = sorted(
+        (topic for topic in topic_info.Topic if topic != -1),
+        key=lambda topic: (-counts[topic], first.get(topic, len(topics))),
+    )
+    mapping = {-1: -1}
+    mapping.update({int(topic): i for i, topic in enumerate(ordered)})
+    return mapping
+
+
+def _single_topic(docs: list) -> tuple:
+    """
+    Put all texts of an object into one topic, in the form
+    of the topic info of a fitted model. Returns it and the topics.
+    """
+    topic_info = pd.DataFrame(
+        {
+            "Topic": [0],
+            "Count": [len(docs)],
+            "Name": ["0_"],
+            "Representation": [[]],
+            "Representative_Docs": [docs[:3]],
+        }
+    )
+    return topic_info, [0] * len(docs)
+
+
+def _cluster_object(
+    docs: list,
+    embeddings: np.ndarray,
+    min_event_size: int,
+    keep_model: bool = False,
+    small_object_size: int = None,
+    terms: tuple = None,
+    fast: bool = False,
+    probability_free: bool = False,
+):
+    """
+    Fit a fresh topic model on the texts of a single object.
+    It is defined on the module level so it could be sent to worker processes.
+    Objects with fewer than small_object_size texts are clustered on
+    the cosine distances of their embeddings, without UMAP.
+    terms are the rows of the shared document-term matrix for the texts
+    and their vocabulary, c-TF-IDF is computed from them instead of
+    tokenizing the texts again.
+    In the fast mode (see EventDetection) UMAP is not seeded and topic ids
+    are renumbered by _stable_topics; the mapping from the ids of the model
+    is kept as its topic_mapping_ attribute.
+    probability_free skips the document x topic membership matrix and
+    assigns outliers to the topic with the nearest embedding, without
+    computing topic distributions or refitting topic representations.
+    Returns the topic info of the fitted model, the topic of every text,
+    the description of a problem met during fitting (or None),
+    the fitted model itself if keep_model is set (or None) and
+    the time spent in seconds.
+    The topic info is None if the model could not be fitted at all,
+    all texts make up one topic if they have no terms to describe topics
+    (see _single_topic).
+    """
+    start = time.perf_counter()
+    texts = docs
+    vectorizer_model = None
+    if terms is not None:
+        rows, vocabulary = terms
+        vectorizer_model = _RowVectorizer(
+            ngram_range=EventDetection.n_gram_range, vocabulary=vocabulary
+        )
+        vectorizer_model.rows = rows
+        docs = [f"d{i}" for i in range(len(texts))]
+    small = small_object_size is not None and len(docs) < small_object_size
+    topic_model = EventDetection._create_model(
+        min_event_size, small, vectorizer_model, fast, probability_free
+    )
+    try:
+        if small:
+            topics, probs = topic_model.fit_transform(
+                docs,
+                embeddings,
+                y=_similarity_clusters(embeddings, min_event_size),
+            )
+        else:
+            topics, probs = topic_model.fit_transform(docs, embeddings)
+    except TypeError as e:
+        problem = f"Can't reduce dimensionality or some other problem: {e}"
+        return None, None, problem, None, time.perf_counter() - start
+    except ValueError as e:
+        # e.g. an empty vocabulary of texts without words
+        problem = f"Can't describe topics, messages make up one topic: {e}"
+        topic_info, topics = _single_topic(texts)
+        return topic_info, topics, problem, None, time.perf_counter() - start
+    problem = None
+    try:
+        if probability_free:
+            topics = topic_model.reduce_outliers(
+                docs, topics, strategy="embeddings", embeddings=embeddings
+            )
+        else:
+            topics = topic_model.reduce_outliers(docs, topics)
+            topic_model.update_topics(
+                docs,
+                topics=topics,
+                vectorizer_model=topic_model.vectorizer_model,
+            )
+    except ValueError as e:
+        problem = f"Can't distribute all messages in topics: {e}"
+    if terms is not None:
+        topic_model.representative_docs_ = {
+            topic: [texts[int(key[1:])] for key in keys]
+            for topic, keys in topic_model.representative_docs_.items()
+        }
+    topic_info = topic_model.get_topic_info()
+    topics = list(topics)
+    if probability_free:
+        # topics are not refitted, so sizes are counted after reassignment
+        topic_info["Count"] = (
+            topic_info.Topic.map(pd.Series(topics).value_counts())
+            .fillna(0)
+            .astype(int)
+        )
+        topic_info = topic_info[
+            (topic_info.Topic != -1) | (topic_info.Count > 0)
+        ].reset_index(drop=True)
+    if fast:
+        mapping = _stable_topics(topic_info, topics)
+        topic_model.topic_mapping_ = mapping
+        topics = [mapping[topic] for topic in topics]
+        topic_info["Name"] = [
+            f"{mapping[topic]}_{name.split('_', 1)[-1]}"
+            for topic, name in zip(topic_info.Topic, topic_info.Name)
+        ]
+        topic_info["Topic"] = topic_info.Topic.map(mapping)
+        topic_info = topic_info.sort_values("Topic").reset_index(drop=True)
+    return (
+        topic_info,
+        topics,
+        problem,
+        topic_model if keep_model else None,
+        time.perf_counter() - start,
+    )
+
+
+_window_detector = None
+
+
+def _detect_window(detector, messages, min_event_size: int):
+    """
+    Detect events among the preprocessed messages of a single time window.
+    It is defined on the module level so it could be sent to worker processes.
+    Returns messages, events and connections of the window,
+    or None if no object of the window has events, and the instrumentation
+    of the window.
+    """
+    detector.text_embeddings = {}
+    detector._reset_terms()
+    detector.instrumentation = Instrumentation()
+    detector.messages = messages
+    detector.events = detector._get_events(min_event_size)
+    if detector.events is None:
+        return None, detector.instrumentation
+    detector._connect_events()
+    return (
+        (detector.messages, detector.events, detector.connections),
+        detector.instrumentation,
+    )
+
+
+def _init_window_worker(detector):
+    """
+    Keep one detector per worker process, so the city layers
+    (buildings, population, links) are sent once per process
+    rather than with every window.
+    """
+    global _window_detector
+    _window_detector = detector
+
+
+def _detect_window_in_worker(messages, min_event_size: int):
+    return _detect_window(_window_detector, messages, min_event_size)
+
+
+class LinkIndex:
+    """
+    This class is aimed to assign geometries to the nearest road links.
+    Links are kept as lines in a projected CRS, and one STRtree built over
+    them answers nearest-within-distance queries for many geometries at once.
+    """
+
+    def __init__(self, links: gpd.GeoDataFrame):
+        self.links = links
+        self.tree = shapely.STRtree(np.asarray(links.geometry.values))
+
+    def nearest(
+        self, geometries: gpd.GeoSeries, max_distance: float
+    ) -> pd.DataFrame:
+        """
+        Find the nearest link within max_distance (in units of the links CRS)
+        for every geometry. Returns link and road ids aligned with
+        the geometries, NaN where no link is close enough.
+        """
+        geometries = geometries.to_crs(self.links.crs)
+        geometry_index, link_index = self.tree.query_nearest(
+            np.asarray(geometries.values),
+            max_distance=max_distance,
+            all_matches=False,
+        )
+        ids = np.full((len(geometries), 2), np.nan)
+        ids[geometry_index] = self.links[["link_id", "road_id"]].to_numpy(
+            dtype=float
+        )[link_index]
+        return pd.DataFrame(
+            ids, columns=["link_id", "road_id"], index=geometries.index
+        )
+
+
+class ModelStore:
+    """
+    This class is aimed to keep fitted topic models of objects on disk.
+    Every model is saved in the compact safetensors form of BERTopic
+    (topic embeddings and c-TF-IDF, without UMAP and HDBSCAN) to
+    a directory keyed by level and object id. The manifest lists
+    the BERTopic version and the hash of the texts of every model,
+    and the mapping of its topic ids for models fitted in the fast mode.
+    Saved models are recorded in memory, the manifest is written
+    at once by flush, so a crash cannot leave it half written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.manifest_path = os.path.join(path, "manifest.json")
+        self.manifest = {}
+        self.changed = False
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    @staticmethod
+    def _key(level: str, object_id) -> str:
+        return f"{level}/{object_id}"
+
+    @staticmethod
+    def data_hash(docs: list) -> str:
+        """
+        Hash the texts a model is fitted on.
+        """
+        return hashlib.sha1("\n".join(docs).encode("utf-8")).hexdigest()
+
+    def save(self, level: str, object_id, model: BERTopic, docs: list):
+        """
+        Save the model of an object and record it in the manifest
+        (written by flush).
+        """
+        key = self._key(level, object_id)
+        os.makedirs(self.path, exist_ok=True)
+        model.save(
+            os.path.join(self.path, key),
+            serialization="safetensors",
+            save_ctfidf=True,
+            save_embedding_model=False,
+        )
+        self.manifest[key] = {
+            "version": bertopic.__version__,
+            "data_hash": self.data_hash(docs),
+        }
+        mapping = getattr(model, "topic_mapping_", None)
+        if mapping is not None:
+            self.manifest[key]["topic_mapping"] = {
+                str(topic): stable for topic, stable in mapping.items()
+            }
+        self.changed = True
+
+    def flush(self):
+        """
+        Write the manifest if models were saved since the last flush.
+        It is written to a temporary file first and then replaces
+        the old manifest.
+        """
+        if not self.changed:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        temp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.manifest_path)
+        self.changed = False
+
+    def load(self, level: str, object_id, data_hash: str = None) -> BERTopic:
+        """
+        Load the model of an object, None if it is not stored or,
+        if data_hash is given, was fitted on other texts (stale).
+        """
+        key = self._key(level, object_id)
+        entry = self.manifest.get(key)
+        if entry is None:
+            return None
+        if data_hash is not None and entry["data_hash"] != data_hash:
+            return None
+        model = BERTopic.load(os.path.join(self.path, key))
+        mapping = entry.get("topic_mapping")
+        if mapping is not None:
+            model.topic_mapping_ = {
+                int(topic): stable for topic, stable in mapping.items()
+            }
+        return model
+
 
 class EventDetection:
     """
     This class is aimed to generate events and their connections.
     It is based on the application of semantic clustering method (BERTopic)
-    on the texts in the context of urban spatial model
+    on the texts in the context of urban spatial model.
+
+    Args:
+        n_jobs (int): The number of worker processes used to cluster objects.
+            1 runs everything in the current process, -1 uses all cores.
+        roads_cache_dir (string): The directory where road links of cities
+            are stored as GeoParquet. None disables the cache.
+        roads_cache_ttl (float): The number of days after which cached
+            road links are downloaded again. None keeps them forever.
+        link_distance (float): The maximum distance in metres from a message
+            to the road link it is assigned to.
+        building_distance (float): The maximum distance in metres from
+            a building to the road link it is assigned to.
+        offline (bool): Never download road links, only read them
+            from the cache (or from osm_pbf).
+        keep_models (bool): Keep the fitted topic model of every object,
+            so update() could assign new messages without refitting.
+        models_dir (string): The directory where the fitted topic model
+            of every object is saved (see ModelStore). None disables it.
+        small_object_size (int): Objects with fewer texts are clustered
+            on cosine distances of embeddings, skipping UMAP.
+            None runs UMAP for objects of every size.
+        min_df (int or float): Terms of the shared vocabulary found in fewer
+            texts (or a smaller share of texts) are dropped, as in
+            CountVectorizer.
+        instrumentation (Instrumentation): Collects timings and counts
+            of stages and clustered objects. A new one is created if None.
+        buildings_cache_dir (string): The directory where the buildings
+            layer, read from the population file, is stored as GeoParquet.
+            None disables the cache.
+        clip_buildings (bool): Read only buildings within building_distance
+            of the bounding box of road links. Buildings outside of it
+            are not counted in the population of the city.
+        hierarchical (bool): Cluster only the coarsest level and derive
+            events of finer levels from the events their messages belong to
+            (see _fit_hierarchy). Derived objects have no topic model,
+            update() refits them when they get new messages.
+        refit_size (int): In the hierarchical mode, objects of finer levels
+            with at least refit_size messages are clustered again instead
+            of being derived. None derives all of them.
+        registry (ModelRegistry): Shares the embedding model with other
+            components. The process-wide registry is used if None.
+        mode (string): "deterministic" seeds numpy and UMAP, so results are
+            reproducible, but UMAP runs single-threaded. "fast" runs UMAP
+            and core distances of HDBSCAN on all cores; results may vary
+            slightly between runs, topic ids are kept stable by numbering
+            topics by their size and first text. With n_jobs > 1 every
+            worker process uses all cores, so one of them is usually enough.
+        probability_free (bool): Do not compute the probabilities of every
+            message to belong to every event (BERTopic keeps only the
+            probability of the assigned event), and assign outliers to
+            the event with the nearest embedding instead of reducing them
+            with topic distributions and refitting representations.
+        dedup_threshold (float): Messages whose texts have an estimated
+            Jaccard similarity of shingles of at least dedup_threshold are
+            near duplicates (see near_duplicate_groups). Only a few copies
+            of a group are clustered in every object, the other messages get
+            their topic. None clusters all messages.
+        osm_pbf (string): The path to a local OSM PBF extract road links
+            are read from instead of downloading them (see OsmExtract).
+            Parsed cities are cached in roads_cache_dir.
     """
-    def __init__(self):
-        np.random.seed(42)
+
+    n_gram_range = (1, 3)
+    min_object_size = 5
+    modes = ("deterministic", "fast")
+    building_columns = ["address", "population_balanced"]
+
+    def __init__(
+        self,
+        n_jobs: int = 1,
+        roads_cache_dir: str = None,
+        roads_cache_ttl: float = None,
+        link_distance: float = 7,
+        building_distance: float = 500,
+        offline: bool = False,
+        keep_models: bool = False,
+        models_dir: str = None,
+        small_object_size: int = None,
+        min_df=1,
+        instrumentation: Instrumentation = None,
+        buildings_cache_dir: str = None,
+        clip_buildings: bool = False,
+        hierarchical: bool = False,
+        refit_size: int = None,
+        registry: ModelRegistry = None,
+        mode: str = "deterministic",
+        dedup_threshold: float = None,
+        osm_pbf: str = None,
+        probability_free: bool = False,
+    ):
+        if mode not in self.modes:
+            raise ValueError(f"mode must be one of {self.modes}, got {mode}")
+        self.mode = mode
+        self.dedup_threshold = dedup_threshold
+        self.probability_free = probability_free
+        if mode == "deterministic":
+            np.random.seed(42)
+        if n_jobs == -1:
+            n_jobs = os.cpu_count() or 1
+        elif n_jobs < 1:
+            raise ValueError(f"n_jobs must be -1 or at least 1, got {n_jobs}")
+        self.n_jobs = n_jobs
+        if offline and roads_cache_dir is None and osm_pbf is None:
+            raise ValueError("offline mode requires roads_cache_dir or osm_pbf")
+        self.roads_cache_dir = roads_cache_dir
+        self.roads_cache_ttl = roads_cache_ttl
+        self.offline = offline
+        self.osm_extract = (
+            None if osm_pbf is None else OsmExtract(osm_pbf, roads_cache_dir)
+        )
+        self.keep_models = keep_models
+        self.models = {}
+        self.model_hashes = {}
+        self.model_store = (
+            None if models_dir is None else ModelStore(models_dir)
+        )
+        self.small_object_size = small_object_size
+        self.min_df = min_df
+        if instrumentation is None:
+            instrumentation = Instrumentation()
+        self.instrumentation = instrumentation
+        self._reset_terms()
+        self.object_clusters = {}
+        self.text_embeddings = {}
+        self.clustered_messages = None
+        self.min_event_size = None
+        self.link_distance = link_distance
+        self.building_distance = building_distance
+        self.embedding_model = None
         self.population_filepath = None
+        self.buildings_cache_dir = buildings_cache_dir
+        self.clip_buildings = clip_buildings
+        self.hierarchical = hierarchical
+        self.refit_size = refit_size
+        self.registry = registry
         self.levels = ["building", "link", "road", "global"]
         self.levels_scale = dict(zip(self.levels, list(range(2, 10, 2))))
         self.functions_weights = {
@@ -40,63 +553,140 @@ class EventDetection:
         }
         self.messages = None
         self.links = None
+        self.link_index = None
         self.buildings = None
         self.population = None
         self.topic_model = None
         self.events = None
         self.connections = None
 
-    def _get_roads(self, city_name, city_crs) -> gpd.GeoDataFrame:
+    def _roads_cache_path(self, city_name, city_crs) -> str:
+        """
+        Get the path of the cached road links of a city.
+        The file is keyed by the city name and its CRS.
+        """
+        key = f"{city_name}|{city_crs}|lines"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.roads_cache_dir, f"links_{digest}.parquet")
+
+    def _get_roads(
+        self, city_name, city_crs, refresh: bool = False
+    ) -> gpd.GeoDataFrame:
         """
         Get the road network of a city as road links and roads.
+        Road links are read from the cache if it is enabled and the cached
+        file is not older than roads_cache_ttl, otherwise they are
+        downloaded from OSM (or read from the OSM PBF extract, if given)
+        and saved to the cache.
         Args:
             city_name (string): The name of the city.
             city_crs (int): The spatial reference code (CRS) of the city.
+            refresh (bool): Download road links even if they are cached.
         Returns:
             links (GeoDataFrame): GeoDataFrame with the city's road links and roads.
         """
+        if self.roads_cache_dir is not None:
+            path = self._roads_cache_path(city_name, city_crs)
+            if self.offline and self.osm_extract is None:
+                if not os.path.exists(path):
+                    raise FileNotFoundError(
+                        f"No cached road links for {city_name} in {path}"
+                    )
+                return gpd.read_parquet(path)
+            if os.path.exists(path) and not refresh:
+                age = (time.time() - os.path.getmtime(path)) / 86400
+                if self.roads_cache_ttl is None or age < self.roads_cache_ttl:
+                    return gpd.read_parquet(path)
+        if self.osm_extract is not None:
+            links = self.osm_extract.road_links(city_name, city_crs)
+        else:
+            links = self._download_roads(city_name, city_crs)
+        if self.roads_cache_dir is not None:
+            os.makedirs(self.roads_cache_dir, exist_ok=True)
+            links.to_parquet(path)
+        return links
+
+    def _download_roads(self, city_name, city_crs) -> gpd.GeoDataFrame:
+        """
+        Download the road network of a city from OSM and convert it to
+        road links with road ids, kept as lines in the CRS of the city.
+        """
         links = ox.graph_from_place(city_name, network_type="drive")
         links = ox.utils_graph.graph_to_gdfs(links, nodes=False).to_crs(
             city_crs
         )
         links = links.reset_index(drop=True)
         links["link_id"] = links.index
-        links["geometry"] = links["geometry"].buffer(7)
-        links = links.to_crs(4326)
         links = links[["link_id", "name", "geometry"]]
         links.loc[links["name"].map(type) == list, "name"] = links[
             links["name"].map(type) == list
         ]["name"].map(lambda x: ", ".join(x))
         road_id_name = dict(enumerate(links.name.dropna().unique().tolist()))
         road_name_id = {v: k for k, v in road_id_name.items()}
-        links["road_id"] = links["name"].replace(road_name_id)
+        links["road_id"] = links["name"].map(road_name_id)
         return links
 
+    def _buildings_bbox(self) -> gpd.GeoSeries:
+        """
+        Get the bounding box of road links grown by building_distance.
+        """
+        minx, miny, maxx, maxy = self.links.total_bounds
+        d = self.building_distance
+        box = shapely.box(minx - d, miny - d, maxx + d, maxy + d)
+        return gpd.GeoSeries([box], crs=self.links.crs)
+
+    def _buildings_cache_path(self, bbox) -> str:
+        """
+        Get the path of the cached buildings layer. The file is keyed by
+        the path, size and modification time of the population file
+        and the bounding box the buildings are clipped to.
+        """
+        stat = os.stat(self.population_filepath)
+        bounds = None if bbox is None else bbox.to_crs(4326).total_bounds
+        key = (
+            f"{os.path.abspath(self.population_filepath)}|{stat.st_size}|"
+            f"{stat.st_mtime_ns}|{self.building_columns}|{bounds}"
+        )
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(
+            self.buildings_cache_dir, f"buildings_{digest}.parquet"
+        )
+
+    def _read_buildings(self) -> gpd.GeoDataFrame:
+        """
+        Read the buildings layer in EPSG:4326 from the cache or from
+        the population file, saving it to the cache if it is enabled.
+        """
+        bbox = self._buildings_bbox() if self.clip_buildings else None
+        if self.buildings_cache_dir is not None:
+            path = self._buildings_cache_path(bbox)
+            if os.path.exists(path):
+                return gpd.read_parquet(path)
+        buildings = read_layer(
+            self.population_filepath, self.building_columns, bbox
+        ).to_crs(4326)
+        if self.buildings_cache_dir is not None:
+            os.makedirs(self.buildings_cache_dir, exist_ok=True)
+            buildings.to_parquet(path)
+        return buildings
+
     def _get_buildings(self) -> gpd.GeoDataFrame:
         """
-        Get the buildings of a city as a GeoDataFrame
-        Args:
-            links(GeoDataFrame): GeoDataFrame with the city's road links and roads.
-            filepath (string): The path to the GeoJSON file with building data. The default is set to 'population.geojson'.
+        Get the buildings of a city as a GeoDataFrame.
+        The population file may be GeoParquet or any format readable
+        by GDAL (GeoJSON, FlatGeobuf, GeoPackage...); only the needed
+        columns are read.
         Returns:
             buildings (GeoDataFrame): GeoDataFrame with the city's buildings.
         """
-        buildings = gpd.read_file(self.population_filepath)
+        buildings = self._read_buildings()
+        buildings["building_id"] = buildings.index
         buildings = buildings[
             ["address", "building_id", "population_balanced", "geometry"]
         ]
-        buildings = buildings.to_crs(4326)
-        buildings["building_id"] = buildings.index
-        buildings = (
-            gpd.sjoin_nearest(
-                buildings,
-                self.links[["link_id", "road_id", "geometry"]],
-                how="left",
-                max_distance=500,
-            )
-            .drop(columns=["index_right"])
-            .drop_duplicates(subset="building_id")
-        )
+        buildings[["link_id", "road_id"]] = self.link_index.nearest(
+            buildings.geometry, self.building_distance
+        ).to_numpy()
         self.buildings = buildings
         return buildings
 
@@ -128,11 +718,11 @@ class EventDetection:
         self.population = pops
         return pops
 
-    def _preprocess(self) -> gpd.GeoDataFrame:
+    def _preprocess(self, messages: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
         """
         Preprocess the data
         """
-        messages = self.messages[
+        messages = messages[
             [
                 "Текст комментария",
                 "geometry",
@@ -156,23 +746,9 @@ class EventDetection:
             columns={"Текст комментария": "text", "Дата и время": "date_time"},
             inplace=True,
         )
-        messages = messages.sjoin(self.links, how="left")[
-            [
-                "text",
-                "geometry",
-                "building_id",
-                "index_right",
-                "name",
-                "message_id",
-                "date_time",
-                "cats",
-                "road_id",
-            ]
-        ]
-        messages.rename(
-            columns={"index_right": "link_id", "name": "road_name"},
-            inplace=True,
-        )
+        messages[["link_id", "road_id"]] = self.link_index.nearest(
+            messages.geometry, self.link_distance
+        ).to_numpy()
         messages = messages.join(
             self.buildings[["link_id", "road_id"]],
             on="building_id",
@@ -204,140 +780,624 @@ class EventDetection:
         messages["global_id"] = 0
         return messages
 
-    def _create_model(self, min_event_size):
+    @staticmethod
+    def _create_model(
+        min_event_size,
+        small: bool = False,
+        vectorizer_model=None,
+        fast: bool = False,
+        probability_free: bool = False,
+    ):
         """
         Create a topic model with a UMAP, HDBSCAN, and a BERTopic model.
+        Texts are embedded beforehand, so the model has no embedding model.
+        The model of a small object takes clusters found beforehand
+        (see _similarity_clusters) and does not reduce dimensionality.
+        vectorizer_model replaces the CountVectorizer fitted by BERTopic.
+        fast leaves UMAP unseeded, so it runs in parallel.
+        probability_free does not calculate the probabilities of documents
+        to belong to every topic.
         """
-        umap_model = UMAP(
-            n_neighbors=15,
-            n_components=5,
-            min_dist=0.0,
-            metric="cosine",
-            random_state=42,
-        )
-        hdbscan_model = HDBSCAN(
-            min_cluster_size=min_event_size,
-            min_samples=1,
-            metric="euclidean",
-            cluster_selection_method="eom",
-            prediction_data=True,
-        )
-        embedding_model = pipeline(
-            "feature-extraction", model="cointegrated/rubert-tiny2"
-        )
+        if small:
+            umap_model = BaseDimensionalityReduction()
+            hdbscan_model = BaseCluster()
+        else:
+            umap_model = UMAP(
+                n_neighbors=15,
+                n_components=5,
+                min_dist=0.0,
+                metric="cosine",
+                random_state=None if fast else 42,
+            )
+            hdbscan_model = HDBSCAN(
+                min_cluster_size=min_event_size,
+                min_samples=1,
+                metric="euclidean",
+                cluster_selection_method="eom",
+                prediction_data=True,
+                core_dist_n_jobs=-1 if fast else 4,
+            )
         topic_model = BERTopic(
-            embedding_model=embedding_model,
             hdbscan_model=hdbscan_model,
             umap_model=umap_model,
-            calculate_probabilities=True,
+            vectorizer_model=vectorizer_model,
+            calculate_probabilities=not probability_free,
             verbose=True,
-            n_gram_range=(1, 3),
+            n_gram_range=EventDetection.n_gram_range,
         )
         return topic_model
 
+    def _embed_texts(self, texts: list) -> np.ndarray:
+        """
+        Embed the texts once with the feature-extraction pipeline.
+        Token features are mean-pooled over the attention mask and
+        normalized, the same way BERTopic pools Hugging Face pipelines.
+        """
+        if self.embedding_model is None:
+            self.embedding_model = (self.registry or default_registry).get(
+                "cointegrated/rubert-tiny2",
+                lambda: pipeline(
+                    "feature-extraction", model="cointegrated/rubert-tiny2"
+                ),
+                backend="feature-extraction",
+            )
+        tokenizer = self.embedding_model.tokenizer
+        features = self.embedding_model(texts, truncation=True, padding=True)
+        embeddings = []
+        for text, token_features in zip(texts, features):
+            token_features = np.array(token_features)
+            mask = tokenizer(text, truncation=True, return_tensors="np")[
+                "attention_mask"
+            ]
+            mask = np.broadcast_to(
+                np.expand_dims(mask, -1), token_features.shape
+            )
+            pooled = (token_features * mask).sum(1) / np.clip(
+                mask.sum(1), 1e-9, None
+            )
+            embeddings.append(normalize(pooled)[0])
+        return np.array(embeddings)
+
+    def _cached_embeddings(self, texts: list) -> np.ndarray:
+        """
+        Get embeddings of texts from the cache, embedding (once) and
+        caching only the texts not seen before.
+        """
+        missing = list(
+            dict.fromkeys(
+                text for text in texts if text not in self.text_embeddings
+            )
+        )
+        if missing:
+            self.text_embeddings.update(
+                zip(missing, self._embed_texts(missing))
+            )
+            self.instrumentation.count("texts_embedded", len(missing))
+        return np.array([self.text_embeddings[text] for text in texts])
+
+    def _reset_terms(self):
+        """
+        Drop the shared vocabulary and document-term matrix,
+        so they are fitted on the texts of the next run.
+        """
+        self.term_vectorizer = None
+        self.terms = None
+        self.term_rows = {}
+        self.document_terms = None
+
+    def _extend_terms(self, texts: list):
+        """
+        Add the terms of new texts (e.g. of an update) missing from
+        the shared vocabulary as new columns of the document-term matrix.
+        """
+        try:
+            new_terms = (
+                CountVectorizer(
+                    ngram_range=self.n_gram_range, min_df=self.min_df
+                )
+                .fit(texts)
+                .get_feature_names_out()
+            )
+        except ValueError:  # no terms left after pruning
+            return
+        added = np.setdiff1d(new_terms, self.terms)
+        if len(added) == 0:
+            return
+        vocabulary = dict(self.term_vectorizer.vocabulary_)
+        vocabulary.update(
+            zip(added, range(len(self.terms), len(self.terms) + len(added)))
+        )
+        self.term_vectorizer = CountVectorizer(
+            ngram_range=self.n_gram_range, vocabulary=vocabulary
+        )
+        self.terms = np.concatenate([self.terms, added])
+        self.document_terms.resize(
+            (self.document_terms.shape[0], len(self.terms))
+        )
+
+    def _count_terms(self, texts: set):
+        """
+        Tokenize texts once into the shared document-term matrix.
+        The vocabulary is fitted on the texts of the first clustering
+        of a run, terms of texts added later (see update) extend it.
+        """
+        texts = [text for text in texts if text not in self.term_rows]
+        if not texts:
+            return
+        if self.term_vectorizer is None:
+            self.term_vectorizer = CountVectorizer(
+                ngram_range=self.n_gram_range, min_df=self.min_df
+            )
+            counts = self.term_vectorizer.fit_transform(texts)
+            self.document_terms = counts.tocsr()
+            self.terms = self.term_vectorizer.get_feature_names_out()
+        else:
+            self._extend_terms(texts)
+            counts = self.term_vectorizer.transform(texts)
+            self.document_terms = sparse.vstack(
+                [self.document_terms, counts]
+            ).tocsr()
+        first_row = self.document_terms.shape[0] - len(texts)
+        self.term_rows.update(
+            zip(texts, range(first_row, first_row + len(texts)))
+        )
+
+    def _object_terms(self, docs: list) -> tuple:
+        """
+        Slice the rows of the texts of an object from the shared
+        document-term matrix, keeping only the terms they contain.
+        Returns the rows and their vocabulary, or None if the texts
+        have no terms left after pruning, so the object is tokenized
+        by its own model.
+        """
+        rows = self.document_terms[[self.term_rows[text] for text in docs]]
+        columns = np.unique(rows.indices)
+        if len(columns) == 0:
+            return None
+        vocabulary = dict(zip(self.terms[columns], range(len(columns))))
+        return rows[:, columns], vocabulary
+
+    def _cluster_objects(self, objects: list, min_event_size: int) -> list:
+        """
+        Cluster the texts of every object, either one after another or
+        in a pool of worker processes (see n_jobs).
+        Big objects are scheduled first to keep the workers busy,
+        results are returned in the order of objects.
+        Texts are embedded only once, embeddings are kept between runs.
+        """
+        tasks = {}
+        for i, (level, object_id, local_messages) in enumerate(objects):
+            docs = local_messages.text.tolist()
+            if len(docs) >= self.min_object_size:
+                tasks[i] = docs
+        self._cached_embeddings(
+            [text for docs in tasks.values() for text in docs]
+        )
+        self._count_terms({text for docs in tasks.values() for text in docs})
+        tasks = {
+            i: (
+                docs,
+                np.array([self.text_embeddings[text] for text in docs]),
+                min_event_size,
+                self.keep_models or self.model_store is not None,
+                self.small_object_size,
+                self._object_terms(docs),
+                self.mode == "fast",
+                self.probability_free,
+            )
+            for i, docs in tasks.items()
+        }
+        order = sorted(tasks, key=lambda i: len(tasks[i][0]), reverse=True)
+        if self.n_jobs > 1:
+            # torch and tokenizers threads are already running after
+            # the embedding, so workers are spawned rather than forked
+            with ProcessPoolExecutor(
+                max_workers=self.n_jobs,
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as executor:
+                futures = {
+                    i: executor.submit(_cluster_object, *tasks[i])
+                    for i in order
+                }
+                results = {i: future.result() for i, future in futures.items()}
+        else:
+            results = {i: _cluster_object(*tasks[i]) for i in order}
+        clusters = [None] * len(objects)
+        self.instrumentation.count("objects_clustered", len(tasks))
+        for i, (event_model, topics, problem, model, seconds) in sorted(
+            results.items()
+        ):
+            level, object_id, _ = objects[i]
+            self.instrumentation.object_timings.append(
+                {
+                    "level": level,
+                    "object_id": str(object_id),
+                    "texts": len(tasks[i][0]),
+                    "seconds": seconds,
+                }
+            )
+            if problem is not None:
+                print(f"{level} {object_id}: {problem}")
+            if event_model is not None:
+                clusters[i] = (event_model, topics)
+            if model is not None and self.model_store is not None:
+                self.model_store.save(level, object_id, model, tasks[i][0])
+                self.model_hashes[(level, object_id)] = ModelStore.data_hash(
+                    tasks[i][0]
+                )
+            if model is not None and self.keep_models:
+                self.models[(level, object_id)] = model
+        if self.model_store is not None:
+            self.model_store.flush()
+        return clusters
+
+    def _get_model(self, level: str, object_id) -> BERTopic:
+        """
+        Get the fitted topic model of an object, either kept in memory
+        or loaded from the model store. None if there is no model.
+        A stored model of an object clustered by this detector is
+        rejected if it was fitted on other texts since.
+        """
+        key = (level, object_id)
+        if key not in self.models and self.model_store is not None:
+            model = self.model_store.load(
+                level, object_id, self.model_hashes.get(key)
+            )
+            if model is not None:
+                self.models[key] = model
+        return self.models.get(key)
+
+    @staticmethod
+    def _transform(model: BERTopic, texts: list, embeddings) -> list:
+        """
+        Predict topics of texts with a fitted model, mapped to stable
+        topic ids if the model was fitted in the fast mode.
+        """
+        topics, _ = model.transform(texts, embeddings)
+        mapping = getattr(model, "topic_mapping_", None)
+        if mapping is None:
+            return list(topics)
+        return [mapping.get(int(topic), int(topic)) for topic in topics]
+
+    def classify(self, texts: list, level: str, object_id) -> pd.DataFrame:
+        """
+        Assign texts to the existing events of an object with its fitted
+        topic model, without refitting. Models are loaded from the model
+        store on demand, so only the objects asked for are read.
+        Returns the topic and the event id of every text, -1 for outliers.
+        """
+        model = self._get_model(level, object_id)
+        if model is None:
+            raise ValueError(f"No topic model of {level} {object_id}")
+        embeddings = self._cached_embeddings(texts)
+        topics = self._transform(model, texts, embeddings)
+        return pd.DataFrame(
+            {
+                "text": texts,
+                "topic": topics,
+                "id": [f"{topic}_{level}_{object_id}" for topic in topics],
+            }
+        )
+
     def _event_from_object(
         self,
-        messages,
-        topic_model,
-        target_column: str,
+        message_ids: list,
+        clustering,
         population: dict,
         object_id: float,
         event_level: str,
     ):
         """
         Create a list of events for a given object
-        (building, street, link, total).
-        """
-        local_messages = messages[messages[target_column] == object_id]
-        message_ids = local_messages.message_id.tolist()
-        docs = local_messages.text.tolist()
-        if len(docs) >= 5:
-            try:
-                topics, probs = topic_model.fit_transform(docs)
-            except TypeError:
-                print("Can't reduce dimensionality or some other problem")
-                return
-            try:
-                topics = topic_model.reduce_outliers(docs, topics)
-                topic_model.update_topics(docs, topics=topics)
-            except ValueError:
-                print("Can't distribute all messages in topics")
-            event_model = topic_model.get_topic_info()
-            event_model["level"] = event_level
-            event_model["object_id"] = str(object_id)
-            event_model["id"] = event_model.apply(
-                lambda x: f"{str(x.Topic)}_{str(x.level)}_{str(x.object_id)}",
-                axis=1,
-            )
-            try:
-                event_model["potential_population"] = population[event_level][
-                    object_id
-                ]
-            except Exception:  # need to select type of error
-                event_model["potential_population"] = population["global"][0]
+        (building, street, link, total) from its clustering result.
+        Returns the events and the assignment of messages to them.
+        """
+        if clustering is None:
+            return
+        event_model, topics = clustering
+        event_model = event_model.copy()
+        event_model["level"] = event_level
+        event_model["object_id"] = str(object_id)
+        event_model["id"] = (
+            event_model.Topic.astype(str) + f"_{event_level}_{object_id}"
+        )
+        try:
+            event_model["potential_population"] = population[event_level][
+                object_id
+            ]
+        except Exception:  # need to select type of error
+            event_model["potential_population"] = population["global"][0]
 
-            clustered_messages = pd.DataFrame(
-                data={"id": message_ids, "text": docs, "topic_id": topics}
+        assignment = pd.DataFrame(
+            data={
+                "id": [
+                    f"{topic}_{event_level}_{object_id}" for topic in topics
+                ],
+                "message_id": message_ids,
+            }
+        )
+        message_ids = assignment.groupby("id", sort=False).message_id.agg(list)
+        # topics left without documents get an empty list, not NaN
+        event_model["message_ids"] = event_model.id.map(message_ids).apply(
+            lambda x: x if isinstance(x, list) else []
+        )
+        return event_model, assignment
+
+    def _event_attributes(self, assignments, messages) -> pd.DataFrame:
+        """
+        Compute duration, category, importance and geometry of all events
+        with grouped aggregations over the message to event assignment table.
+        """
+        table = assignments.drop_duplicates().merge(
+            messages[
+                ["message_id", "date_time", "cats", "importance", "geometry"]
+            ],
+            on="message_id",
+        )
+        table["date_time"] = pd.to_datetime(table.date_time)
+        grouped = table.groupby("id")
+        attributes = pd.DataFrame(
+            {
+                "duration": (
+                    grouped.date_time.max() - grouped.date_time.min()
+                ).dt.days,
+                "importance": grouped.importance.mean(),
+            }
+        )
+        counts = table.groupby(["id", "cats"]).size().rename("n").reset_index()
+        counts = counts[counts.n == counts.groupby("id").n.transform("max")]
+        attributes["category"] = counts.groupby("id").cats.agg(", ".join)
+        attributes["geometry"] = (
+            gpd.GeoDataFrame(table[["id", "geometry"]], geometry="geometry")
+            .dissolve(by="id")
+            .representative_point()
+        )
+        return attributes
+
+    def _group_objects(self, messages) -> list:
+        """
+        Split messages into the objects of all levels, coarse levels first.
+        """
+        return [
+            (level, oid, local_messages)
+            for level in reversed(self.levels)
+            for oid, local_messages in messages.groupby(
+                f"{level}_id", sort=False
             )
-            event_model["message_ids"] = [
-                clustered_messages[clustered_messages["topic_id"] == topic][
-                    "id"
-                ].tolist()
-                for topic in event_model.Topic
+        ]
+
+    def _mark_duplicates(self, messages) -> pd.DataFrame:
+        """
+        Add the group of near-duplicate texts of every message.
+        """
+        messages = messages.copy()
+        messages["duplicate_group"] = near_duplicate_groups(
+            messages.text.tolist(), self.dedup_threshold
+        )
+        return messages
+
+    def _collapse_duplicates(self, local_messages, min_event_size: int):
+        """
+        Keep only as many copies of every group of near duplicates as
+        an event or an object needs at least, so a group still can make
+        up an event on its own.
+        """
+        copies = max(min_event_size, self.min_object_size)
+        return local_messages.groupby("duplicate_group", sort=False).head(
+            copies
+        )
+
+    @staticmethod
+    def _expand_duplicates(topic_info, local_messages, kept, topics):
+        """
+        Give every message the topic of the first kept copy of its group
+        and count topics over all messages.
+        """
+        topic_of = (
+            pd.Series(topics, index=kept.duplicate_group.to_numpy())
+            .groupby(level=0)
+            .first()
+        )
+        topics = local_messages.duplicate_group.map(topic_of).tolist()
+        topic_info = topic_info.copy()
+        topic_info["Count"] = (
+            topic_info.Topic.map(pd.Series(topics).value_counts())
+            .fillna(0)
+            .astype(int)
+        )
+        return topic_info, topics
+
+    def _fit_objects(self, objects: list, min_event_size: int):
+        """
+        Cluster the given objects and keep their clustering results.
+        Near duplicates are collapsed before clustering and expanded back
+        if dedup_threshold is set.
+        """
+        kept = [local_messages for _, _, local_messages in objects]
+        if self.dedup_threshold is not None:
+            kept = [
+                self._collapse_duplicates(local_messages, min_event_size)
+                for local_messages in kept
             ]
-            event_model["duration"] = event_model.message_ids.map(
-                lambda x: (
-                    pd.to_datetime(
-                        messages[messages["message_id"].isin(x)].date_time
-                    ).max()
-                    - pd.to_datetime(
-                        messages[messages["message_id"].isin(x)].date_time
-                    ).min()
-                ).days
+            self.instrumentation.count(
+                "duplicates_collapsed",
+                sum(len(o[2]) for o in objects) - sum(map(len, kept)),
             )
-            event_model["category"] = event_model.message_ids.map(
-                lambda x: ", ".join(
-                    messages[messages["message_id"].isin(x)]
-                    .cats.mode()
-                    .tolist()
+        clusters = self._cluster_objects(
+            [(level, oid, k) for (level, oid, _), k in zip(objects, kept)],
+            min_event_size,
+        )
+        for (level, oid, local_messages), kept_messages, clustering in zip(
+            objects, kept, clusters
+        ):
+            if clustering is None:
+                continue
+            topic_info, topics = clustering
+            if self.dedup_threshold is not None:
+                topic_info, topics = self._expand_duplicates(
+                    topic_info, local_messages, kept_messages, topics
                 )
+            self.object_clusters[(level, oid)] = (
+                topic_info,
+                local_messages.message_id.tolist(),
+                topics,
             )
-            event_model["importance"] = event_model.message_ids.map(
-                lambda x: messages[
-                    messages["message_id"].isin(x)
-                ].importance.mean()
-            )
-            return event_model
-        else:
-            return
 
-    def _get_events(self, min_event_size) -> gpd.GeoDataFrame:
+    def _derive_object(
+        self, local_messages, labels: dict, min_event_size: int
+    ) -> tuple:
         """
-        Create a list of events for all levels.
+        Derive the clustering of an object from the events of coarser
+        objects its messages belong to. labels map message ids to the key
+        of the coarser object and the topic of the message in it.
+        Messages of the object sharing a coarser event make up an event,
+        events with fewer than min_event_size messages become outliers.
+        Names, representations and representative docs are taken from
+        the coarser events. Returns the topic info and the topics.
         """
-        messages = self.messages.copy()
-        messages_list = messages.text.tolist()
-        index_list = messages.message_id.tolist()
-        pops = self._collect_population()
-        topic_model = self._create_model(min_event_size)
+        texts = local_messages.text.tolist()
+        parents = [
+            labels.get(message_id) for message_id in local_messages.message_id
+        ]
+        parents = [
+            None if parent is None or parent[1] == -1 else parent
+            for parent in parents
+        ]
+        counts = Counter(parent for parent in parents if parent is not None)
         events = [
-            [
-                self._event_from_object(
-                    messages, topic_model, f"{level}_id", pops, oid, level
+            parent
+            for parent, count in counts.most_common()
+            if count >= min_event_size
+        ]
+        topic_of = {parent: topic for topic, parent in enumerate(events)}
+        topics = [topic_of.get(parent, -1) for parent in parents]
+        rows = []
+        for topic, parent in [(-1, None), *enumerate(events)]:
+            members = [text for text, t in zip(texts, topics) if t == topic]
+            if not members:
+                continue
+            if parent is None:
+                name, representation, docs = "outliers", [], []
+            else:
+                parent_info = self.object_clusters[parent[0]][0]
+                row = parent_info[parent_info.Topic == parent[1]].iloc[0]
+                name = row.Name.split("_", 1)[-1]
+                representation = row.Representation
+                docs = [
+                    doc for doc in row.Representative_Docs if doc in members
+                ]
+            rows.append(
+                {
+                    "Topic": topic,
+                    "Count": len(members),
+                    "Name": f"{topic}_{name}",
+                    "Representation": representation,
+                    "Representative_Docs": docs or members[:3],
+                }
+            )
+        return pd.DataFrame(rows), topics
+
+    def _fit_hierarchy(self, messages, min_event_size: int):
+        """
+        Cluster the objects of the coarsest level and derive the objects
+        of finer levels from them, level by level (see _derive_object),
+        so every message is clustered about once. Objects with at least
+        refit_size messages are clustered again, their events are used
+        to derive the finer objects within them.
+        """
+        labels = {}
+        for depth, level in enumerate(reversed(self.levels)):
+            objects = [
+                (level, oid, local_messages)
+                for oid, local_messages in messages.groupby(
+                    f"{level}_id", sort=False
                 )
-                for oid in messages[f"{level}_id"].unique().tolist()
             ]
-            for level in reversed(self.levels)
-        ]
+            refit = [
+                (level, oid, local_messages)
+                for level, oid, local_messages in objects
+                if depth == 0
+                or (
+                    self.refit_size is not None
+                    and len(local_messages) >= self.refit_size
+                )
+            ]
+            self._fit_objects(refit, min_event_size)
+            refitted = {(level, oid) for level, oid, _ in refit}
+            derived = 0
+            for level, oid, local_messages in objects:
+                if (level, oid) in refitted or (
+                    len(local_messages) < self.min_object_size
+                ):
+                    continue
+                topic_info, topics = self._derive_object(
+                    local_messages, labels, min_event_size
+                )
+                self.object_clusters[(level, oid)] = (
+                    topic_info,
+                    local_messages.message_id.tolist(),
+                    topics,
+                )
+                derived += 1
+            self.instrumentation.count("objects_derived", derived)
+            for level, oid, _ in objects:
+                if (level, oid) in self.object_clusters:
+                    _, message_ids, topics = self.object_clusters[(level, oid)]
+                    labels.update(
+                        zip(message_ids, [((level, oid), t) for t in topics])
+                    )
+
+    def _get_events(self, min_event_size) -> gpd.GeoDataFrame:
+        """
+        Create a list of events for all levels.
+        """
+        self.min_event_size = min_event_size
+        self.clustered_messages = self.messages.copy()
+        if self.dedup_threshold is not None:
+            self.clustered_messages = self._mark_duplicates(
+                self.clustered_messages
+            )
+        self._collect_population()
+        self.object_clusters = {}
+        if self.hierarchical:
+            self._fit_hierarchy(self.clustered_messages, min_event_size)
+        else:
+            self._fit_objects(
+                self._group_objects(self.clustered_messages), min_event_size
+            )
+        return self._build_events()
+
+    def _build_events(self) -> gpd.GeoDataFrame:
+        """
+        Create events of all objects from their clustering results.
+        Returns None if no object has been clustered.
+        """
+        if not self.object_clusters:
+            return None
+        messages = self.clustered_messages
+        message_id_by_text = (
+            messages.drop_duplicates(subset="text")
+            .set_index("text")
+            .message_id.to_dict()
+        )
         events = [
-            item for sublist in events for item in sublist if item is not None
+            self._event_from_object(
+                message_ids,
+                (topic_info, topics),
+                self.population,
+                oid,
+                level,
+            )
+            for (level, oid), (
+                topic_info,
+                message_ids,
+                topics,
+            ) in self.object_clusters.items()
         ]
-        events = pd.concat(list(chain(events)))
-        events["geometry"] = events.message_ids.map(
-            lambda x: messages[
-                messages.message_id.isin(x)
-            ].geometry.unary_union.representative_point()
-        )
+        assignments = pd.concat([assignment for _, assignment in events])
+        events = pd.concat([event_model for event_model, _ in events])
+        attributes = self._event_attributes(assignments, messages)
+        events = events.join(attributes, on="id")
         events = gpd.GeoDataFrame(events, geometry="geometry").set_crs(4326)
         events.rename(
             columns={
@@ -349,13 +1409,9 @@ class EventDetection:
             inplace=True,
         )
         events["docs"] = events["docs"].map(
-            lambda x: ", ".join(
-                [str(index_list[messages_list.index(text)]) for text in x]
-            )
-        )
-        events.message_ids = events.message_ids.map(
-            lambda x: ", ".join([str(id) for id in x])
+            lambda x: sorted({message_id_by_text[text] for text in x})
         )
+        events["message_ids"] = events.message_ids.map(lambda x: sorted(set(x)))
         events["intensity"] = (
             events["intensity"] - events["intensity"].min()
         ) / (events["intensity"].max() - events["intensity"].min())
@@ -370,88 +1426,102 @@ class EventDetection:
             * events.importance
             * events.population
         )
-        events["message_ids"] = events.message_ids.map(
-            lambda x: ", ".join(list(set(x.split(", "))))
-        )
-        events["docs"] = events.docs.map(
-            lambda x: ", ".join(list(set(x.split(", "))))
-        )
         return events
 
     def _get_event_connections(self) -> gpd.GeoDataFrame:
         """
         Create a list of connections between events.
+        Only pairs of events sharing messages are generated: the weight of
+        a pair is the number of common messages, taken from the product
+        of the sparse event x message incidence matrix with itself.
         """
-        events = self.events.copy()
-        events.index = events.id
-        events.geometry = events.centroid
-        weights = [
-            len((set(c[0]) & set(c[1])))
-            for c in combinations(self.events.message_ids, 2)
-        ]
-        nodes = [c for c in combinations(events.id, 2)]
-        connections = pd.DataFrame(nodes, weights).reset_index()
-        connections.columns = ["weight", "a", "b"]
-        connections = connections[connections["weight"] > 0]
-        connections = connections.join(events.geometry, on="a", rsuffix="_")
-        connections = connections.join(events.geometry, on="b", rsuffix="_")
-        events.reset_index(drop=True, inplace=True)
-        connections["geometry"] = connections.apply(
-            lambda x: LineString([x["geometry"], x["geometry_"]]), axis=1
-        )
-        connections.drop(columns=["geometry_"], inplace=True)
+        events = self.events.reset_index(drop=True)
+        incidence = (
+            events.message_ids.explode()
+            .dropna()
+            .reset_index()
+            .drop_duplicates()
+        )
+        message_codes, _ = pd.factorize(incidence.message_ids)
+        incidence = sparse.csr_matrix(
+            (
+                np.ones(len(message_codes), dtype=np.int64),
+                (incidence["index"].to_numpy(), message_codes),
+            ),
+            shape=(len(events), message_codes.max() + 1),
+        )
+        overlap = sparse.triu(incidence @ incidence.T, k=1).tocoo()
+        order = np.lexsort((overlap.col, overlap.row))
+        a, b = overlap.row[order], overlap.col[order]
+        connections = pd.DataFrame(
+            {
+                "weight": overlap.data[order],
+                "a": events.id.to_numpy()[a],
+                "b": events.id.to_numpy()[b],
+            }
+        )
+        points = shapely.get_coordinates(events.geometry)
         connections = gpd.GeoDataFrame(
-            connections, geometry="geometry"
-        ).set_crs(32636)
+            connections,
+            geometry=shapely.linestrings(np.stack([points[a], points[b]], 1)),
+            crs=events.crs,
+        )
         return connections
 
-    def _rebalance(
-        self, connections, events, levels, event_population: int, event_id: str
-    ):
+    def _rebalance(self, events, connections) -> np.ndarray:
         """
-        Rebalance the population of an event.
+        Rebalance the population of events.
+        The population of every event is reduced by the population of
+        connected events of finer levels: first the events it is connected to
+        (column "b" of connections), or, if those account for more than
+        the event itself, the events connected to it (column "a").
+        Sums for all events of a level come from products of
+        a sparse event adjacency matrix with the population vector.
         """
-        connections_of_event = connections[connections.a == event_id].b
-        if len(connections_of_event) > 0:
-            accounted_pops = events[
-                events.id.isin(connections_of_event) & events.level.isin(levels)
-            ].population.sum()
-            if event_population >= accounted_pops:
-                rebalanced_pops = event_population - accounted_pops
-            else:
-                connections_of_event = connections[connections.b == event_id].a
-                accounted_pops = events[
-                    events.id.isin(connections_of_event)
-                    & events.level.isin(levels)
-                ].population.sum()
-                rebalanced_pops = event_population - accounted_pops
-            return rebalanced_pops
-        else:
-            return event_population
+        position = pd.Series(np.arange(len(events)), index=events.id)
+        adjacency = sparse.csr_matrix(
+            (
+                np.ones(len(connections)),
+                (
+                    position[connections.a].to_numpy(),
+                    position[connections.b].to_numpy(),
+                ),
+            ),
+            shape=(len(events), len(events)),
+        )
+        has_connections = np.diff(adjacency.indptr) > 0
+        population = events.population.to_numpy(dtype=float)
+        event_levels = events.level.to_numpy()
+        rebalanced = population.copy()
+        for level in self.levels[1:]:
+            levels_to_account = self.levels[: self.levels.index(level)]
+            accounted = np.where(
+                np.isin(event_levels, levels_to_account),
+                np.nan_to_num(population),
+                0,
+            )
+            accounted_outgoing = adjacency @ accounted
+            accounted_incoming = adjacency.T @ accounted
+            level_rebalanced = np.where(
+                population >= accounted_outgoing,
+                population - accounted_outgoing,
+                population - accounted_incoming,
+            )
+            in_level = (event_levels == level) & has_connections
+            rebalanced[in_level] = level_rebalanced[in_level]
+        return rebalanced
 
     def _rebalance_events(self) -> gpd.GeoDataFrame:
         """
         Rebalance the population of events.
         """
-        levels = self.levels.copy()
         events = self.events.copy()
-        connections = self.connections.copy()
-        events_rebalanced = []
-        for level in levels[1:]:
-            levels_to_account = levels[: levels.index(level)]
-            events_for_level = events[events.level == level]
-            events_for_level["rebalanced_population"] = events_for_level.apply(
-                lambda x: self._rebalance(
-                    connections,
-                    events,
-                    levels_to_account,
-                    x.population,
-                    x.id,
-                ),
-                axis=1,
-            )
-            events_rebalanced.append(events_for_level)
-        events_rebalanced = pd.concat(events_rebalanced)
+        events["rebalanced_population"] = self._rebalance(
+            events, self.connections
+        )
+        events_rebalanced = pd.concat(
+            [events[events.level == level] for level in self.levels[1:]]
+        )
         events_rebalanced.loc[
             events_rebalanced.rebalanced_population.isna(),
             "rebalanced_population",
@@ -534,6 +1604,138 @@ class EventDetection:
         messages = messages.to_crs(4326)
         return messages
 
+    def _connect_events(self):
+        """
+        Connect, rebalance and filter detected events and prepare messages.
+        """
+        stage = self.instrumentation.stage
+        with stage("connections") as record:
+            self.connections = self._get_event_connections()
+            record["connections"] = len(self.connections)
+        print("connections generated")
+        with stage("rebalance", events=len(self.events)):
+            self.events = self._rebalance_events()
+        print("population and risk rebalanced")
+        with stage("filter outliers") as record:
+            self.events, self.connections = self._filter_outliers()
+            record["events"] = len(self.events)
+        print("outliers filtered")
+        with stage("prepare messages", messages=len(self.messages)):
+            self.messages = self._prepare_messages()
+        print("done!")
+
+    def _assign_to_events(
+        self, level: str, object_id, new_messages, min_share, max_outliers
+    ) -> bool:
+        """
+        Assign new messages of an object to its existing events with
+        approximate prediction of the kept topic model.
+        Returns False if the object has to be refitted: it has no model,
+        new messages make up more than min_share of its messages,
+        or more than max_outliers of them are outliers.
+        """
+        key = (level, object_id)
+        model = self._get_model(level, object_id)
+        if model is None or key not in self.object_clusters:
+            return False
+        topic_info, message_ids, topics = self.object_clusters[key]
+        share = len(new_messages) / (len(message_ids) + len(new_messages))
+        if share > min_share:
+            return False
+        docs = new_messages.text.tolist()
+        embeddings = self._cached_embeddings(docs)
+        new_topics = self._transform(model, docs, embeddings)
+        if np.mean(np.asarray(new_topics) == -1) > max_outliers:
+            return False
+        message_ids = message_ids + new_messages.message_id.tolist()
+        topics = topics + list(new_topics)
+        topic_info = topic_info.copy()
+        topic_info["Count"] = (
+            topic_info.Topic.map(pd.Series(topics).value_counts())
+            .fillna(0)
+            .astype(int)
+        )
+        self.object_clusters[key] = (topic_info, message_ids, topics)
+        return True
+
+    def update(
+        self,
+        new_texts: gpd.GeoDataFrame,
+        min_share: float = 0.2,
+        max_outliers: float = 0.5,
+    ):
+        """
+        Add newly arrived messages to the events detected by run.
+        Messages of objects with a kept topic model (see keep_models) are
+        assigned to existing events by approximate prediction. An object is
+        refitted on all its messages only when the share of new messages
+        exceeds min_share or the share of outliers among them exceeds
+        max_outliers; objects without a model are refitted as well.
+        Events and connections are updated in place and returned together
+        with messages, as in run.
+        """
+        if self.clustered_messages is None:
+            raise RuntimeError("update requires events detected by run")
+        stage = self.instrumentation.stage
+        with stage("preprocess", messages=len(new_texts)):
+            new_messages = self._preprocess(new_texts.copy())
+        print("new messages preprocessed")
+        self.clustered_messages = pd.concat(
+            [self.clustered_messages, new_messages]
+        )
+        if self.dedup_threshold is not None:
+            self.clustered_messages = self._mark_duplicates(
+                self.clustered_messages
+            )
+        new_objects = self._group_objects(new_messages)
+        with stage("assign", objects=len(new_objects)) as record:
+            to_refit = {
+                (level, oid)
+                for level, oid, local_messages in new_objects
+                if not self._assign_to_events(
+                    level, oid, local_messages, min_share, max_outliers
+                )
+            }
+            record["assigned"] = len(new_objects) - len(to_refit)
+        objects = [
+            (level, oid, local_messages)
+            for level, oid, local_messages in self._group_objects(
+                self.clustered_messages
+            )
+            if (level, oid) in to_refit
+        ]
+        with stage("refit", objects=len(objects)):
+            self._fit_objects(objects, self.min_event_size)
+        print(
+            len(objects),
+            "objects refitted of",
+            len(new_objects),
+            "objects with new messages",
+        )
+        self.messages = self.clustered_messages
+        with stage("events") as record:
+            self.events = self._build_events()
+            record["events"] = len(self.events)
+        print("events updated")
+        self._connect_events()
+
+        return self.messages, self.events, self.connections
+
+    def _load_city(self, city_name, city_crs, refresh_roads: bool = False):
+        """
+        Load road links and buildings of a city.
+        """
+        stage = self.instrumentation.stage
+        with stage("roads") as record:
+            self.links = self._get_roads(city_name, city_crs, refresh_roads)
+            self.link_index = LinkIndex(self.links)
+            record["links"] = len(self.links)
+        print("road links loaded")
+        with stage("buildings") as record:
+            self.buildings = self._get_buildings()
+            record["buildings"] = len(self.buildings)
+        print("buildings loaded")
+
     def run(
         self,
         target_texts: gpd.GeoDataFrame,
@@ -541,29 +1743,207 @@ class EventDetection:
         city_name: str,
         city_crs: int,
         min_event_size: int,
+        refresh_roads: bool = False,
     ):
         """
         Returns a GeoDataFrame of events, a GeoDataFrame of
         connections between events, and a GeoDataFrame of messages.
+        Set refresh_roads to download road links even if they are cached.
         """
+        stage = self.instrumentation.stage
         self.population_filepath = filepath_to_population
+        self._reset_terms()
         self.messages = target_texts.copy()
         print("messages loaded")
-        self.links = self._get_roads(city_name, city_crs)
-        print("road links loaded")
-        self.buildings = self._get_buildings()
-        print("buildings loaded")
-        self.messages = self._preprocess()
+        self._load_city(city_name, city_crs, refresh_roads)
+        with stage("preprocess", messages=len(self.messages)):
+            self.messages = self._preprocess(self.messages)
         print("messages preprocessed")
-        self.events = self._get_events(min_event_size)
+        with stage("events", messages=len(self.messages)) as record:
+            self.events = self._get_events(min_event_size)
+            if self.events is None:
+                raise ValueError(
+                    "No object has enough messages to detect events"
+                )
+            record["objects"] = len(self.object_clusters)
+            record["events"] = len(self.events)
         print("events detected")
-        self.connections = self._get_event_connections()
-        print("connections generated")
-        self.events = self._rebalance_events()
-        print("population and risk rebalanced")
-        self.events, self.connections = self._filter_outliers()
-        print("outliers filtered")
-        self.messages = self._prepare_messages()
-        print("done!")
+        self._connect_events()
 
         return self.messages, self.events, self.connections
+
+    @staticmethod
+    def _time_windows(dates: pd.Series, window: str, overlap: str) -> list:
+        """
+        Split the time range of dates into windows of the given length,
+        consecutive windows share overlap. Returns (start, end) pairs.
+        """
+        window, overlap = pd.Timedelta(window), pd.Timedelta(overlap)
+        if not pd.Timedelta(0) <= overlap < window:
+            raise ValueError(
+                "overlap must be non-negative and shorter than window"
+            )
+        start, last = dates.min(), dates.max()
+        windows = []
+        while True:
+            windows.append((start, start + window))
+            if start + window > last:
+                return windows
+            start = start + window - overlap
+
+    @staticmethod
+    def _stitch_windows(window_events: pd.DataFrame) -> pd.DataFrame:
+        """
+        Stitch events of consecutive windows which belong to the same object
+        and are each other's best match by shared messages of the overlap.
+        Every event gets the id of the stitched event it belongs to,
+        made of the window and the id of its earliest event.
+        """
+        window_events = window_events.sort_values(["window", "id"]).reset_index(
+            drop=True
+        )
+        members = window_events.assign(
+            node=window_events.index,
+            object=window_events.id.str.split("_", n=1).str[1],
+            message_id=window_events.message_ids,
+        ).explode("message_id")[["node", "window", "object", "message_id"]]
+        members = members.dropna(subset=["message_id"])
+        following = members.assign(window=members.window - 1)
+        shared = (
+            members.merge(following, on=["window", "object", "message_id"])
+            .groupby(["node_x", "node_y"])
+            .size()
+            .rename("shared")
+            .reset_index()
+        )
+        # an event continues in the event of the next window it shares
+        # most messages with, if it is the best match for that one as well
+        best_next = shared.loc[shared.groupby("node_x").shared.idxmax()]
+        best_previous = shared.loc[shared.groupby("node_y").shared.idxmax()]
+        pairs = best_next.merge(best_previous, on=["node_x", "node_y"])
+        graph = sparse.csr_matrix(
+            (
+                np.ones(len(pairs)),
+                (pairs.node_x.to_numpy(), pairs.node_y.to_numpy()),
+            ),
+            shape=(len(window_events), len(window_events)),
+        )
+        _, components = connected_components(graph, directed=False)
+        first = (
+            pd.Series(np.arange(len(window_events)))
+            .groupby(components)
+            .transform("min")
+            .to_numpy()
+        )
+        window_events["event_id"] = (
+            window_events.window.astype(str).to_numpy()[first]
+            + "_"
+            + window_events.id.to_numpy()[first]
+        )
+        return window_events[["window", "id", "event_id"]]
+
+    def run_windowed(
+        self,
+        target_texts: gpd.GeoDataFrame,
+        filepath_to_population: str,
+        city_name: str,
+        city_crs: int,
+        min_event_size: int,
+        output_dir: str,
+        window: str = "90D",
+        overlap: str = "7D",
+        refresh_roads: bool = False,
+    ) -> pd.DataFrame:
+        """
+        Detect events in time windows of messages, e.g. for backfills
+        over several years. Messages are split by date into windows of
+        the given length (a pandas timedelta such as "90D"), consecutive
+        windows share overlap. Windows are processed in n_jobs worker
+        processes, one window per process at a time; the detector with
+        the city layers is sent to every process once and at most n_jobs
+        windows are queued. Counters and timings of windows are merged
+        into the instrumentation. Messages, events and connections
+        of a window are written to output_dir as GeoParquet files
+        (window_<number>_<name>.parquet, see storage.read_outputs)
+        as soon as it is done, only
+        event ids are kept in memory. Topic models are neither kept
+        nor stored in this mode.
+        Events of consecutive windows continuing across the boundary
+        (same object, shared messages in the overlap) are stitched.
+        Returns the id of the stitched event of every window event
+        (window, id, event_id), also written to stitched_events.parquet.
+        """
+        stage = self.instrumentation.stage
+        self.population_filepath = filepath_to_population
+        self._load_city(city_name, city_crs, refresh_roads)
+        with stage("preprocess", messages=len(target_texts)):
+            messages = self._preprocess(target_texts.copy())
+        print("messages preprocessed")
+        dates = pd.to_datetime(messages.date_time)
+        windows = self._time_windows(dates, window, overlap)
+        tasks = {
+            i: messages[(dates >= start) & (dates < end)]
+            for i, (start, end) in enumerate(windows)
+        }
+        del messages
+        detector = copy.copy(self)
+        detector.n_jobs = 1
+        detector.keep_models = False
+        detector.model_store = None
+        detector.models = {}
+        detector.instrumentation = None
+        detector.links = None
+        detector.link_index = None
+        if self.n_jobs > 1:
+            detector.embedding_model = None
+        os.makedirs(output_dir, exist_ok=True)
+
+        window_events = []
+
+        def write_window(i, result):
+            result, instrumentation = result
+            self.instrumentation.merge(instrumentation, window=i)
+            if result is None:
+                print(f"window {i}: no events")
+                return
+            write_outputs(output_dir, *result, prefix=f"window_{i}_")
+            window_events.append(
+                result[1][["id", "message_ids"]].assign(window=i)
+            )
+            print(f"window {i} done")
+
+        with stage("windows", windows=len(tasks)) as record:
+            if self.n_jobs > 1:
+                with ProcessPoolExecutor(
+                    max_workers=self.n_jobs,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_window_worker,
+                    initargs=(detector,),
+                ) as executor:
+                    futures = {}
+                    while tasks or futures:
+                        # windows are submitted as workers free up,
+                        # so only about n_jobs of them are in memory
+                        while tasks and len(futures) < self.n_jobs:
+                            i = next(iter(tasks))
+                            future = executor.submit(
+                                _detect_window_in_worker,
+                                tasks.pop(i),
+                                min_event_size,
+                            )
+                            futures[future] = i
+                        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            write_window(futures.pop(future), future.result())
+            else:
+                for i in list(tasks):
+                    write_window(
+                        i,
+                        _detect_window(detector, tasks.pop(i), min_event_size),
+                    )
+            record["windows_with_events"] = len(window_events)
+        if not window_events:
+            raise ValueError("No window has enough messages to detect events")
+        stitched = self._stitch_windows(pd.concat(window_events))
+        stitched.to_parquet(os.path.join(output_dir, "stitched_events.parquet"))
+        return stitched
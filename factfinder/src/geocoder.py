@@ -4,7 +4,7 @@ location in the text.
 In this scenario texts are comments in social networks (e.g. Vkontakte).
 Thus the model was trained on the corpus of comments on Russian language.
 """
-import numpy as np 
+import numpy as np
 import re
 import warnings
 from typing import List, Optional
@@ -25,22 +25,23 @@ from geopy.exc import GeocoderUnavailable
 from geopy.geocoders import Nominatim
 from shapely.geometry import Point
 from tqdm import tqdm
+
+from .instrumentation import Instrumentation
+from .osm import OsmExtract
+from .model_registry import ModelRegistry, default_registry
 from natasha import (
     Segmenter,
     MorphVocab,
-    
     NewsEmbedding,
     NewsMorphTagger,
     NewsSyntaxParser,
     NewsNERTagger,
-    
     PER,
     NamesExtractor,
     DatesExtractor,
     MoneyExtractor,
     AddrExtractor,
-
-    Doc
+    Doc,
 )
 
 segmenter = Segmenter()
@@ -67,6 +68,8 @@ class Location:
     This class is aimed to efficiently geocode addresses using Nominatim.
     Geocoded addresses are stored in the 'book' dictionary argument.
     Thus, if the address repeats -- it would be taken from the book.
+    The number of requests sent and of addresses taken from the book
+    are counted in requests and cache_hits.
     """
 
     max_tries = 3
@@ -75,6 +78,8 @@ class Location:
         self.geolocator = Nominatim(user_agent="soika")
         self.addr = []
         self.book = {}
+        self.requests = 0
+        self.cache_hits = 0
 
     def geocode_with_retry(self, query: str) -> Optional[List[float]]:
         """
@@ -84,6 +89,7 @@ class Location:
         """
 
         for _ in range(Location.max_tries):
+            self.requests += 1
             try:
                 geocode = self.geolocator.geocode(
                     query, addressdetails=True, language="ru"
@@ -99,6 +105,8 @@ class Location:
             query = f"{address}"
             res = self.geocode_with_retry(query)
             self.book[address] = res
+        else:
+            self.cache_hits += 1
 
         return self.book.get(address)
 
@@ -111,6 +119,13 @@ class Streets:
     """
 
     global_crs: int = 4326
+    overpass_url = "http://overpass-api.de/api/interpreter"
+    name_parts = re.compile(
+        r"путепровод|улица|набережная реки|проспект"
+        r"|бульвар|мост|переулок|площадь|переулок"
+        r"|набережная|канала|канал|дорога на|дорога в"
+        r"|шоссе|аллея|проезд"
+    )
 
     @staticmethod
     def get_city_bounds(
@@ -121,7 +136,6 @@ class Streets:
         using Overpass API and returns a GeoDataFrame representing
         the boundary as a polygon.
         """
-        overpass_url = "http://overpass-api.de/api/interpreter"
         overpass_query = f"""
         [out:json];
                 area[name="{osm_city_name}"]->.searchArea;
@@ -132,7 +146,7 @@ class Streets:
         """
 
         result = requests.get(
-            overpass_url, params={"data": overpass_query}
+            Streets.overpass_url, params={"data": overpass_query}
         ).json()
         resp = osm2geojson.json2geojson(result)
         city_bounds = gpd.GeoDataFrame.from_features(resp["features"]).set_crs(
@@ -164,7 +178,7 @@ class Streets:
         """
 
         gdf = ox.graph_to_gdfs(G_drive, nodes=False)
-        gdf["name"].dropna(inplace=True)
+        gdf = gdf.dropna(subset=["name"])
         gdf = gdf[["name", "length", "geometry"]]
         gdf.reset_index(inplace=True)
         gdf = gpd.GeoDataFrame(data=gdf, geometry="geometry")
@@ -178,10 +192,48 @@ class Streets:
         GeoDataFrame of street segments.
         """
 
-        names = set(gdf["name"].explode().dropna())
-        df_streets = pd.DataFrame(names, columns=["street"])
+        return Streets.unique_names(gdf["name"].explode())
+
+    @staticmethod
+    def unique_names(names: pd.Series) -> pd.DataFrame:
+        """
+        Method strips street names and drops empty and repeated ones,
+        keeping the order of their first occurrence.
+        """
+
+        names = names.dropna().astype(str).str.strip()
+        names = names[names != ""].drop_duplicates()
+        return pd.DataFrame({"street": names.to_numpy()})
+
+    @staticmethod
+    def get_named_ways(osm_city_name: str, osm_city_level: int) -> pd.DataFrame:
+        """
+        Method retrieves only the names of named highways (streets,
+        pedestrian streets, embankments...) and squares within the boundary
+        of a specified city using Overpass API. Only tags of the ways are
+        downloaded, without their geometry or the street network.
+        """
 
-        return df_streets
+        overpass_query = f"""
+        [out:json];
+                area[name="{osm_city_name}"]->.searchArea;
+                relation["admin_level"="{osm_city_level}"](area.searchArea);
+                map_to_area->.cityArea;
+                (
+                way["highway"]["name"](area.cityArea);
+                way["place"="square"]["name"](area.cityArea);
+                );
+        out tags;
+        """
+
+        result = requests.get(
+            Streets.overpass_url, params={"data": overpass_query}
+        ).json()
+        names = pd.Series(
+            [element["tags"]["name"] for element in result["elements"]],
+            dtype=object,
+        )
+        return Streets.unique_names(names)
 
     @staticmethod
     def drop_words_from_name(x: str) -> str:
@@ -191,13 +243,7 @@ class Streets:
         """
 
         try:
-            lst = re.split(
-                r"путепровод|улица|набережная реки|проспект"
-                r"|бульвар|мост|переулок|площадь|переулок"
-                r"|набережная|канала|канал|дорога на|дорога в"
-                r"|шоссе|аллея|проезд",
-                x,
-            )
+            lst = Streets.name_parts.split(x)
             lst.remove("")
 
             return lst[0].strip().lower()
@@ -221,11 +267,31 @@ class Streets:
         return streets_df
 
     @staticmethod
-    def run(osm_city_name: str, osm_city_level: int) -> pd.DataFrame:
-        city_bounds = Streets.get_city_bounds(osm_city_name, osm_city_level)
-        streets_graph = Streets.get_drive_graph(city_bounds)
-        streets_gdf = Streets.graph_to_gdf(streets_graph)
-        streets_df = Streets.get_street_names(streets_gdf)
+    def run(
+        osm_city_name: str,
+        osm_city_level: int,
+        names_only: bool = False,
+        osm_extract: OsmExtract = None,
+    ) -> pd.DataFrame:
+        """
+        Method gets the street names of a city, either from its drivable
+        street network or, if names_only is set, from the names of all
+        named highways and squares (see get_named_ways).
+        With osm_extract the names are read from a local OSM PBF extract
+        instead of Overpass and OSMnx.
+        """
+        if osm_extract is not None:
+            segments = osm_extract.segments(
+                osm_city_name, osm_city_level, drive_only=not names_only
+            )
+            streets_df = Streets.unique_names(segments["name"])
+        elif names_only:
+            streets_df = Streets.get_named_ways(osm_city_name, osm_city_level)
+        else:
+            city_bounds = Streets.get_city_bounds(osm_city_name, osm_city_level)
+            streets_graph = Streets.get_drive_graph(city_bounds)
+            streets_gdf = Streets.graph_to_gdf(streets_graph)
+            streets_df = Streets.get_street_names(streets_gdf)
         streets_df = Streets.clear_names(streets_df)
 
         return streets_df
@@ -233,15 +299,34 @@ class Streets:
 
 class Geocoder:
     """
-    This class provides a functionality of simple geocoder
+    This class provides a functionality of simple geocoder.
+    Timings of its stages, NER calls, geocoder requests and cache hits
+    are collected by the instrumentation (a new one is created if None).
+    The NER model is taken from the registry (the process-wide one
+    if None), so geocoders of a process share it.
+    With streets_names_only street names are taken from the tags of named
+    ways only (see Streets.get_named_ways), without the street network.
+    With osm_pbf street names are read from a local OSM PBF extract
+    (see OsmExtract), parsed cities are cached in osm_cache_dir.
     """
 
     dir_path = os.path.dirname(os.path.realpath(__file__))
 
     global_crs: int = 4326
-    exceptions = pd.merge(pd.read_csv(os.path.join(dir_path, "exceptions_countries.csv"), encoding="utf-8", sep=",")
-                        ,pd.read_csv(os.path.join(dir_path, "exсeptions_city.csv"), encoding="utf-8", sep=","), 
-                        on='Сокращенное наименование', how='outer')
+    exceptions = pd.merge(
+        pd.read_csv(
+            os.path.join(dir_path, "exceptions_countries.csv"),
+            encoding="utf-8",
+            sep=",",
+        ),
+        pd.read_csv(
+            os.path.join(dir_path, "exсeptions_city.csv"),
+            encoding="utf-8",
+            sep=",",
+        ),
+        on="Сокращенное наименование",
+        how="outer",
+    )
 
     def __init__(
         self,
@@ -249,12 +334,29 @@ class Geocoder:
         device: str = "cpu",
         osm_city_level: int = 5,
         osm_city_name: str = "Санкт-Петербург",
+        instrumentation: Instrumentation = None,
+        registry: ModelRegistry = None,
+        streets_names_only: bool = False,
+        osm_pbf: str = None,
+        osm_cache_dir: str = None,
     ):
+        if instrumentation is None:
+            instrumentation = Instrumentation()
+        self.instrumentation = instrumentation
         self.device = device
         flair.device = torch.device(device)
-        self.classifier = SequenceTagger.load(model_path)
+        self.classifier = (registry or default_registry).get(
+            model_path,
+            lambda: SequenceTagger.load(model_path),
+            device=device,
+            backend="flair",
+        )
         self.osm_city_level = osm_city_level
         self.osm_city_name = osm_city_name
+        self.streets_names_only = streets_names_only
+        self.osm_extract = (
+            None if osm_pbf is None else OsmExtract(osm_pbf, osm_cache_dir)
+        )
 
     def extract_ner_street(self, text: str) -> pd.Series:
         """
@@ -271,6 +373,38 @@ class Geocoder:
 
         sentence = Sentence(text)
         self.classifier.predict(sentence)
+        self.instrumentation.count("ner_calls")
+        return self._street_from_sentence(sentence)
+
+    def extract_ner_streets(
+        self, texts: list, batch_size: int = 32
+    ) -> List[pd.Series]:
+        """
+        Extract mentioned addresses from several texts as extract_ner_street
+        does, tagging them with batched forward passes of the NER model.
+        """
+        results = [pd.Series([None, None]) for _ in texts]
+        sentences = {}
+        for i, text in enumerate(texts):
+            try:
+                sentences[i] = Sentence(re.sub(r"\[.*?\]", "", text))
+            except Exception:
+                continue
+        if sentences:
+            self.classifier.predict(
+                list(sentences.values()), mini_batch_size=batch_size
+            )
+            self.instrumentation.count("ner_calls", len(sentences))
+        for i, sentence in sentences.items():
+            results[i] = self._street_from_sentence(sentence)
+        return results
+
+    @staticmethod
+    def _street_from_sentence(sentence) -> pd.Series:
+        """
+        Get the street and its score from a tagged sentence,
+        None if the score is not above 0.7.
+        """
         try:
             res = (
                 sentence.get_labels("ner")[0]
@@ -283,17 +417,18 @@ class Geocoder:
                 return pd.Series([res, score])
             else:
                 return pd.Series([None, None])
-    
 
         except IndexError:
             return pd.Series([None, None])
-    
+
     # Блок с Наташей
-    def get_ner_address_natasha(row, exceptions, text_col): #input: string, list, series... output: string
+    def get_ner_address_natasha(
+        row, exceptions, text_col
+    ):  # input: string, list, series... output: string
         if row["Street"] == None or row["Street"] == np.nan:
             i = row[text_col]
             location_final = []
-            i = re.sub(r'\[.*?\]', '', i)
+            i = re.sub(r"\[.*?\]", "", i)
             doc = Doc(i)
             doc.segment(segmenter)
             doc.tag_morph(morph_tagger)
@@ -301,9 +436,14 @@ class Geocoder:
             doc.tag_ner(ner_tagger)
             for span in doc.spans:
                 span.normalize(morph_vocab)
-            location = list(filter(lambda x: x.type == 'LOC', doc.spans))
+            location = list(filter(lambda x: x.type == "LOC", doc.spans))
             for span in location:
-                if span.normal.lower() not in exceptions['Сокращенное наименование'].str.lower().values:
+                if (
+                    span.normal.lower()
+                    not in exceptions["Сокращенное наименование"]
+                    .str.lower()
+                    .values
+                ):
                     location_final.append(span)
             location_final = [(span.text) for span in location_final]
             if not location_final:
@@ -311,7 +451,6 @@ class Geocoder:
             return location_final[0]
         else:
             return row["Street"]
-    
 
     @staticmethod
     def get_stem(street_names_df: pd.DataFrame) -> pd.DataFrame:
@@ -415,8 +554,15 @@ class Geocoder:
         df[["Street", "Score"]] = df[text_column].progress_apply(
             lambda t: self.extract_ner_street(t)
         )
-        df["Street"] = df[[text_column,"Street"]].progress_apply(
-            lambda row: Geocoder.get_ner_address_natasha(row, self.exceptions, text_column), axis=1)
+        self.instrumentation.count(
+            "natasha_calls", int(df["Street"].isna().sum())
+        )
+        df["Street"] = df[[text_column, "Street"]].progress_apply(
+            lambda row: Geocoder.get_ner_address_natasha(
+                row, self.exceptions, text_column
+            ),
+            axis=1,
+        )
         df = df[df.Street.notna()]
         df = df[df["Street"].str.contains("[а-яА-Я]")]
 
@@ -437,7 +583,10 @@ class Geocoder:
         Function simply creates gdf from the recognised geocoded geometries.
         """
 
-        df["Location"] = df["addr_to_geocode"].progress_apply(Location().query)
+        location = Location()
+        df["Location"] = df["addr_to_geocode"].progress_apply(location.query)
+        self.instrumentation.count("geocoder_requests", location.requests)
+        self.instrumentation.count("geocoder_cache_hits", location.cache_hits)
         df = df.dropna(subset=["Location"])
         df["geometry"] = df.Location.apply(
             lambda x: Point(x.longitude, x.latitude)
@@ -498,13 +647,26 @@ class Geocoder:
         return gdf
 
     def run(self, df: pd.DataFrame, text_column: str = "Текст комментария"):
+        stage = self.instrumentation.stage
         initial_df = df.copy()
-        street_names = Streets.run(self.osm_city_name, self.osm_city_level)
-
-        df = self.get_street(df, text_column)
-        street_names = self.get_stem(street_names)
-        df = self.find_word_form(df, street_names)
-        gdf = self.create_gdf(df)
+        with stage("streets") as record:
+            street_names = Streets.run(
+                self.osm_city_name,
+                self.osm_city_level,
+                self.streets_names_only,
+                self.osm_extract,
+            )
+            record["streets"] = len(street_names)
+
+        with stage("ner", messages=len(df)):
+            df = self.get_street(df, text_column)
+        with stage("stems", streets=len(street_names)):
+            street_names = self.get_stem(street_names)
+        with stage("word forms", messages=len(df)):
+            df = self.find_word_form(df, street_names)
+        with stage("geocoding", addresses=len(df)) as record:
+            gdf = self.create_gdf(df)
+            record["geocoded"] = len(gdf)
         gdf = self.merge_to_initial_df(gdf, initial_df)
 
         # Add a new 'level' column using the get_level function
@@ -0,0 +1,124 @@
+"""
+This module is aimed to measure where time and memory go in the stages
+of text classification, geocoding and event detection.
+Every stage records its wall time, CPU time (including finished worker
+processes), the peak resident memory of the process, how much the stage
+raised it, and item counts.
+"""
+import json
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def _cpu_time() -> float:
+    times = os.times()
+    return (
+        times.user + times.system + times.children_user + times.children_system
+    )
+
+
+def _peak_rss_mb() -> float:
+    """
+    Peak resident set size of the process in megabytes, None if unknown.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return usage / 1024**2 if sys.platform == "darwin" else usage / 1024
+
+
+class Instrumentation:
+    """
+    This class is aimed to collect timings and counters of pipeline stages.
+    Hooks are callables receiving the record of every finished stage,
+    e.g. to send it to a job scheduler. Records are kept in stages,
+    global counters (NER calls, geocoder requests, cache hits...)
+    in counters and timings of clustered objects in object_timings.
+    """
+
+    def __init__(self, hooks: list = None):
+        self.hooks = list(hooks or [])
+        self.stages = []
+        self.counters = Counter()
+        self.object_timings = []
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    @contextmanager
+    def stage(self, name: str, **counts):
+        """
+        Measure a stage. Item counts are passed as keyword arguments
+        or added to the yielded record while the stage runs.
+        peak_rss_mb is the high-water mark of the process up to the end
+        of the stage, not of the stage alone: stages after the most
+        memory-hungry one report the same value. peak_rss_growth_mb is
+        how much the stage raised it, 0 if the stage stayed below
+        the peak of earlier stages.
+        """
+        record = {"stage": name, **counts}
+        wall, cpu = time.perf_counter(), _cpu_time()
+        peak_rss = _peak_rss_mb()
+        try:
+            yield record
+        finally:
+            record["wall_time"] = time.perf_counter() - wall
+            record["cpu_time"] = _cpu_time() - cpu
+            record["peak_rss_mb"] = _peak_rss_mb()
+            record["peak_rss_growth_mb"] = (
+                None if peak_rss is None else record["peak_rss_mb"] - peak_rss
+            )
+            self.stages.append(record)
+            for hook in self.hooks:
+                hook(record)
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    def merge(self, other: "Instrumentation", **labels):
+        """
+        Add the stages, counters and object timings collected by other
+        instrumentation, e.g. of a worker process. Labels (such as
+        the window) are added to its stage records.
+        """
+        self.stages.extend({**record, **labels} for record in other.stages)
+        self.counters.update(other.counters)
+        self.object_timings.extend(other.object_timings)
+
+    def slowest_objects(self, n: int = 10) -> list:
+        """
+        Get the n objects that took the longest to cluster.
+        """
+        return sorted(
+            self.object_timings, key=lambda x: x["seconds"], reverse=True
+        )[:n]
+
+    def report(self, path: str = None, slowest: int = 10) -> dict:
+        """
+        Get the report of all stages, counters and slowest objects.
+        If path is given, the report is written to it: as JSON if
+        it ends with .json, otherwise stages are written as CSV.
+        """
+        report = {
+            "stages": self.stages,
+            "counters": dict(self.counters),
+            "slowest_objects": self.slowest_objects(slowest),
+        }
+        if path is not None:
+            if path.endswith(".json"):
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(report, f, ensure_ascii=False, indent=2)
+            else:
+                pd.DataFrame(self.stages).to_csv(path, index=False)
+        return report
@@ -0,0 +1,119 @@
+"""
+This module is aimed to share loaded models between the classifiers,
+the geocoder and event detection of a process. Models are kept by their
+repository id, device and backend, so creating several instances
+of a component loads the weights only once.
+"""
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def _model_size_mb(model) -> float:
+    """
+    Size of the parameters and buffers of a torch model in megabytes.
+    Hugging Face pipelines are measured by their model, objects that are
+    not torch modules count as 0.
+    """
+    module = getattr(model, "model", model)
+    if not isinstance(module, torch.nn.Module):
+        return 0.0
+    tensors = [*module.parameters(), *module.buffers()]
+    return sum(x.numel() * x.element_size() for x in tensors) / 1024**2
+
+
+class ModelRegistry:
+    """
+    This class is aimed to cache loaded models and hand out shared
+    instances of them. Models are loaded on the first request by the given
+    loader and kept in the order of use. When their total size exceeds
+    memory_budget_mb (None for no limit), the least recently used models
+    are dropped from the registry; instances already handed out stay
+    usable until they are released by their owners.
+    A registry sent to another process arrives empty.
+
+    Args:
+        memory_budget_mb (float): The maximum total size of kept models.
+    """
+
+    def __init__(self, memory_budget_mb: float = None):
+        self.memory_budget_mb = memory_budget_mb
+        self._models = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        return {"memory_budget_mb": self.memory_budget_mb}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(
+        self,
+        repository_id: str,
+        loader,
+        device=None,
+        backend: str = "transformers",
+    ):
+        """
+        Get the model of a repository on a device, loading it with
+        loader (a callable without arguments) if it is not kept yet.
+        """
+        key = (repository_id, str(device), backend)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key]["model"]
+            model = loader()
+            self.misses += 1
+            self._models[key] = {
+                "model": model,
+                "size_mb": _model_size_mb(model),
+            }
+            self._evict()
+            return model
+
+    def _evict(self):
+        """
+        Drop the least recently used models until the kept ones fit into
+        the memory budget. The most recent model is always kept.
+        """
+        if self.memory_budget_mb is None:
+            return
+        while len(self._models) > 1 and self.size_mb > self.memory_budget_mb:
+            self._models.popitem(last=False)
+            self.evictions += 1
+
+    @property
+    def size_mb(self) -> float:
+        return sum(entry["size_mb"] for entry in self._models.values())
+
+    def loaded(self) -> list:
+        """
+        Get the kept models from the least to the most recently used.
+        """
+        with self._lock:
+            return [
+                {
+                    "repository_id": repository_id,
+                    "device": device,
+                    "backend": backend,
+                    "size_mb": entry["size_mb"],
+                }
+                for (
+                    repository_id,
+                    device,
+                    backend,
+                ), entry in self._models.items()
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+default_registry = ModelRegistry()
@@ -0,0 +1,310 @@
+"""
+This module is aimed to read city boundaries, street names and road links
+from a local OSM PBF extract instead of Overpass and OSMnx, e.g. on
+machines without access to the public APIs. The extract is streamed
+per city with pyosmium (an optional dependency): the boundary is read
+first, then only highways within its bounding box are kept. The boundary
+and highway segments found are cached as GeoParquet.
+"""
+import hashlib
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+try:
+    import osmium
+except ImportError:  # optional, only needed to scan PBF extracts
+    osmium = None
+
+# highways OSMnx keeps in the "drive" network
+DRIVE_HIGHWAYS = {
+    "motorway",
+    "motorway_link",
+    "trunk",
+    "trunk_link",
+    "primary",
+    "primary_link",
+    "secondary",
+    "secondary_link",
+    "tertiary",
+    "tertiary_link",
+    "unclassified",
+    "residential",
+    "living_street",
+    "road",
+    "service",
+}
+NOT_DRIVE_SERVICES = {
+    "alley",
+    "driveway",
+    "emergency_access",
+    "parking",
+    "parking_aisle",
+    "private",
+}
+
+
+def _is_drivable(tags: dict) -> bool:
+    return (
+        tags.get("highway") in DRIVE_HIGHWAYS
+        and tags.get("service") not in NOT_DRIVE_SERVICES
+        and tags.get("access") != "private"
+        and tags.get("motor_vehicle") != "no"
+        and tags.get("motorcar") != "no"
+        and tags.get("area") != "yes"
+    )
+
+
+if osmium is not None:
+
+    class _BoundaryHandler(osmium.SimpleHandler):
+        """
+        Collect administrative boundaries named as the city.
+        """
+
+        def __init__(self, city_name: str):
+            super().__init__()
+            self.city_name = city_name
+            self.factory = osmium.geom.WKBFactory()
+            self.boundaries = []
+
+        def area(self, a):
+            tags = a.tags
+            if (
+                a.from_way()
+                or tags.get("boundary") != "administrative"
+                or tags.get("name") != self.city_name
+            ):
+                return
+            try:
+                wkb = self.factory.create_multipolygon(a)
+            except RuntimeError:
+                return
+            self.boundaries.append((tags.get("admin_level"), wkb))
+
+    class _WayHandler(osmium.SimpleHandler):
+        """
+        Collect highways and named squares whose bounding box intersects
+        bounds (min lon, min lat, max lon, max lat) with the ids and
+        locations of their nodes; ways outside are dropped as they are read.
+        """
+
+        def __init__(self, bounds: tuple):
+            super().__init__()
+            self.bounds = bounds
+            self.ways = []
+
+        def way(self, w):
+            tags = w.tags
+            highway = tags.get("highway")
+            if highway is None and not (
+                tags.get("place") == "square" and "name" in tags
+            ):
+                return
+            nodes = [n for n in w.nodes if n.location.valid()]
+            if len(nodes) < 2:
+                return
+            lons = [n.lon for n in nodes]
+            lats = [n.lat for n in nodes]
+            min_lon, min_lat, max_lon, max_lat = self.bounds
+            if (
+                max(lons) < min_lon
+                or min(lons) > max_lon
+                or max(lats) < min_lat
+                or min(lats) > max_lat
+            ):
+                return
+            tags = dict(tags)
+            self.ways.append(
+                (
+                    tags.get("name"),
+                    highway,
+                    _is_drivable(tags),
+                    [n.ref for n in nodes],
+                    list(zip(lons, lats)),
+                )
+            )
+
+
+def _split_ways(ways: list, crs=4326) -> gpd.GeoDataFrame:
+    """
+    Split ways into segments between intersections, i.e. nodes shared
+    by several highways (or met twice in a highway), as OSMnx splits them
+    into graph edges. Squares (without highway) are kept whole.
+    """
+    refs = [np.asarray(way[3]) for way in ways if way[1] is not None]
+    nodes, counts = np.unique(
+        np.concatenate(refs) if refs else np.array([], dtype=np.int64),
+        return_counts=True,
+    )
+    intersections = set(nodes[counts > 1].tolist())
+    rows = []
+    for name, highway, drive, way_refs, coords in ways:
+        cuts = [
+            i
+            for i, ref in enumerate(way_refs[1:-1], start=1)
+            if highway is not None and ref in intersections
+        ]
+        bounds = [0, *cuts, len(way_refs) - 1]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            rows.append(
+                (
+                    name,
+                    highway,
+                    drive,
+                    shapely.LineString(coords[start : end + 1]),
+                )
+            )
+    return gpd.GeoDataFrame(
+        pd.DataFrame(rows, columns=["name", "highway", "drive", "geometry"]),
+        geometry="geometry",
+        crs=crs,
+    )
+
+
+class OsmExtract:
+    """
+    This class is aimed to provide the city boundary, street names and
+    road links of a city from a local OSM PBF extract.
+    The extract is streamed per city: boundaries are assembled first
+    (pyosmium reads relations twice for it), then ways are read keeping
+    only highways and named squares within the bounding box of the city,
+    so memory does not grow with the size of the extract beyond the node
+    locations pyosmium indexes. The boundary and the segments within it
+    are kept in memory and, if
+    cache_dir is given, stored as GeoParquet keyed by the path, size
+    and modification time of the extract and the name of the city.
+
+    Args:
+        path (string): The path to the .osm.pbf extract.
+        cache_dir (string): The directory where parsed cities are stored.
+            None disables the cache.
+    """
+
+    global_crs: int = 4326
+
+    def __init__(self, path: str, cache_dir: str = None):
+        self.path = path
+        self.cache_dir = cache_dir
+        self._cities = {}
+
+    def _cache_paths(self, city_name: str) -> tuple:
+        stat = os.stat(self.path)
+        key = (
+            f"{os.path.abspath(self.path)}|{stat.st_size}|"
+            f"{stat.st_mtime_ns}|{city_name}"
+        )
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return tuple(
+            os.path.join(self.cache_dir, f"osm_{digest}_{name}.parquet")
+            for name in ["boundaries", "segments"]
+        )
+
+    def _scan(self, city_name: str) -> tuple:
+        """
+        Read the boundaries of the city, then the highway ways and named
+        squares within their bounding box from the extract.
+        """
+        if osmium is None:
+            raise ImportError(
+                "reading OSM PBF extracts requires pyosmium"
+                " (pip install osmium)"
+            )
+        boundary_handler = _BoundaryHandler(city_name)
+        boundary_handler.apply_file(self.path, locations=True)
+        if not boundary_handler.boundaries:
+            return [], []
+        bounds = shapely.from_wkb(
+            [wkb for _, wkb in boundary_handler.boundaries]
+        )
+        way_handler = _WayHandler(tuple(shapely.total_bounds(bounds).tolist()))
+        way_handler.apply_file(self.path, locations=True)
+        return boundary_handler.boundaries, way_handler.ways
+
+    def _parse(self, city_name: str) -> tuple:
+        """
+        Get the boundaries named as the city and the highway segments
+        intersecting them.
+        """
+        boundaries, ways = self._scan(city_name)
+        if not boundaries:
+            raise ValueError(
+                f"No administrative boundary named {city_name} in {self.path}"
+            )
+        boundaries = gpd.GeoDataFrame(
+            {"admin_level": [level for level, _ in boundaries]},
+            geometry=shapely.from_wkb([wkb for _, wkb in boundaries]),
+            crs=self.global_crs,
+        )
+        segments = _split_ways(ways, self.global_crs)
+        area = boundaries.unary_union
+        segments = segments.iloc[
+            np.sort(segments.sindex.query(area, predicate="intersects"))
+        ].reset_index(drop=True)
+        return boundaries, segments
+
+    def _city(self, city_name: str) -> tuple:
+        """
+        Get the boundaries and segments of a city from memory, the cache
+        or the extract.
+        """
+        if city_name in self._cities:
+            return self._cities[city_name]
+        paths = None
+        if self.cache_dir is not None:
+            paths = self._cache_paths(city_name)
+            if all(os.path.exists(path) for path in paths):
+                self._cities[city_name] = tuple(map(gpd.read_parquet, paths))
+                return self._cities[city_name]
+        self._cities[city_name] = self._parse(city_name)
+        if paths is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for frame, path in zip(self._cities[city_name], paths):
+                frame.to_parquet(path)
+        return self._cities[city_name]
+
+    def boundary(self, city_name: str, admin_level=None) -> gpd.GeoDataFrame:
+        """
+        Get the boundary of a city of the given administrative level,
+        or of the lowest level (the largest unit) the city has boundaries
+        of if there is no such level.
+        """
+        boundaries, _ = self._city(city_name)
+        levels = pd.to_numeric(boundaries.admin_level, errors="coerce")
+        selected = boundaries[levels == float(admin_level or np.nan)]
+        if selected.empty and levels.notna().any():
+            selected = boundaries[levels == levels.min()]
+        elif selected.empty:
+            selected = boundaries
+        return selected.dissolve().reset_index(drop=True)
+
+    def segments(
+        self, city_name: str, admin_level=None, drive_only: bool = False
+    ) -> gpd.GeoDataFrame:
+        """
+        Get highway segments and named squares intersecting the boundary
+        of a city, only drivable highways if drive_only is set.
+        """
+        _, segments = self._city(city_name)
+        if drive_only:
+            segments = segments[segments.drive.astype(bool)]
+        area = self.boundary(city_name, admin_level).geometry.iloc[0]
+        rows = segments.sindex.query(area, predicate="intersects")
+        return segments.iloc[np.sort(rows)].reset_index(drop=True)
+
+    def road_links(self, city_name: str, city_crs) -> gpd.GeoDataFrame:
+        """
+        Get drivable road links of a city with road ids, in the CRS
+        of the city, as EventDetection downloads them with OSMnx.
+        Every segment is one link, not one link per direction.
+        """
+        links = self.segments(city_name, drive_only=True).to_crs(city_crs)
+        links["link_id"] = links.index
+        links = links[["link_id", "name", "geometry"]]
+        road_id_name = dict(enumerate(links.name.dropna().unique().tolist()))
+        road_name_id = {v: k for k, v in road_id_name.items()}
+        links["road_id"] = links["name"].map(road_name_id)
+        return links
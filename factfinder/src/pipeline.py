@@ -0,0 +1,242 @@
+"""
+This module is aimed to run text classification, geocoding and event
+detection as one pipeline. The output of every stage is cached on disk
+under a hash of its inputs and parameters (including model ids), so
+changing a parameter reruns only the stages depending on it.
+"""
+import hashlib
+import inspect
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from .cascade import CascadeModel
+from .event_detection import EventDetection
+from .geocoder import Geocoder
+from .instrumentation import Instrumentation
+from .text_classifier import TextClassifier
+
+
+class Pipeline:
+    """
+    This class is aimed to run the stages "classification", "geocoding"
+    and "events" over a DataFrame of texts. Classification and geocoding
+    do not depend on each other and run concurrently, their results
+    are joined and passed to event detection.
+
+    Args:
+        cache_dir (string): The directory where stage outputs are stored.
+        classifier_params (dict): Arguments of TextClassifier.
+        geocoder_params (dict): Arguments of Geocoder.
+        event_params (dict): Arguments of EventDetection.
+        text_column (string): The name of the column with texts.
+        instrumentation (Instrumentation): Collects timings of stages.
+    """
+
+    components = {
+        "classification": TextClassifier,
+        "geocoding": Geocoder,
+        "events": EventDetection,
+    }
+    # arguments changing how a stage runs, not what it outputs
+    execution_params = {
+        "instrumentation",
+        "registry",
+        "n_jobs",
+        "device",
+        "device_type",
+        "keep_models",
+        "models_dir",
+        "roads_cache_dir",
+        "buildings_cache_dir",
+        "osm_cache_dir",
+    }
+
+    def __init__(
+        self,
+        cache_dir: str,
+        classifier_params: dict = None,
+        geocoder_params: dict = None,
+        event_params: dict = None,
+        text_column: str = "Текст комментария",
+        instrumentation: Instrumentation = None,
+    ):
+        self.cache_dir = cache_dir
+        self.params = {
+            "classification": classifier_params or {},
+            "geocoding": geocoder_params or {},
+            "events": event_params or {},
+        }
+        self.text_column = text_column
+        self._components = {}
+        if instrumentation is None:
+            instrumentation = Instrumentation()
+        self.instrumentation = instrumentation
+
+    def __getstate__(self):
+        # loaded models are not sent to worker processes
+        state = self.__dict__.copy()
+        state["_components"] = {}
+        return state
+
+    def _stage_params(self, stage: str) -> dict:
+        """
+        Get all arguments of the component of a stage, defaults included,
+        so the model ids the component uses by default are hashed as well.
+        Execution settings (execution_params, e.g. the number of workers
+        or cache directories) do not change outputs and are left out.
+        A cascade model, given as an object or a path, is hashed by
+        its content, so refitting it invalidates cached outputs.
+        """
+        signature = inspect.signature(self.components[stage])
+        params = signature.bind(**self.params[stage])
+        params.apply_defaults()
+        params = {
+            name: value
+            for name, value in params.arguments.items()
+            if name not in self.execution_params
+        }
+        cascade = params.get("cascade")
+        if isinstance(cascade, CascadeModel):
+            params["cascade"] = cascade.digest()
+        elif isinstance(cascade, str):
+            params["cascade"] = CascadeModel.file_digest(cascade)
+        return params
+
+    def _create(self, stage: str):
+        """
+        Create the component of a stage once, sharing the instrumentation
+        of the pipeline if the component supports it.
+        """
+        if stage not in self._components:
+            component = self.components[stage]
+            params = dict(self.params[stage])
+            if "instrumentation" in inspect.signature(component).parameters:
+                params.setdefault("instrumentation", self.instrumentation)
+            self._components[stage] = component(**params)
+        return self._components[stage]
+
+    def _key(self, stage: str, inputs: list, **params) -> str:
+        """
+        Hash the inputs of a stage together with its parameters.
+        """
+        content = {
+            "stage": stage,
+            "inputs": inputs,
+            "component": self._stage_params(stage),
+            "params": params,
+        }
+        return hashlib.sha1(
+            json.dumps(content, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    @staticmethod
+    def _hash_frame(df: pd.DataFrame) -> str:
+        values = pd.util.hash_pandas_object(df, index=True).to_numpy()
+        columns = ",".join(map(str, df.columns)).encode("utf-8")
+        return hashlib.sha1(values.tobytes() + columns).hexdigest()
+
+    @staticmethod
+    def _hash_file(path: str) -> str:
+        """
+        Identify a file by its path, size and modification time.
+        """
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+    def _cached(self, stage: str, key: str, compute):
+        """
+        Read the output of a stage from the cache or compute and store it.
+        """
+        path = os.path.join(self.cache_dir, f"{stage}_{key}.pkl")
+        with self.instrumentation.stage(stage) as record:
+            record["cached"] = os.path.exists(path)
+            if record["cached"]:
+                return pd.read_pickle(path)
+            result = compute(self._create(stage))
+            os.makedirs(self.cache_dir, exist_ok=True)
+            pd.to_pickle(result, path)
+        print(f"{stage} done")
+        return result
+
+    def _classify(self, classifier, df: pd.DataFrame) -> pd.DataFrame:
+        return pd.DataFrame(
+            df[self.text_column].map(classifier.run).to_list(),
+            columns=["cats", "probs"],
+            index=df.index,
+        )
+
+    def _geocode(self, geocoder, df: pd.DataFrame) -> pd.DataFrame:
+        return geocoder.run(df.copy(), text_column=self.text_column)
+
+    def prepare(self, df: pd.DataFrame) -> tuple:
+        """
+        Classify and geocode texts. Returns the messages with categories
+        and locations, and the keys of both stages.
+        """
+        df = df.reset_index(drop=True)
+        if "message_id" not in df.columns:
+            df["message_id"] = df.index
+        classification_key = self._key(
+            "classification",
+            [self._hash_frame(df[[self.text_column]])],
+            text_column=self.text_column,
+        )
+        geocoding_key = self._key(
+            "geocoding", [self._hash_frame(df)], text_column=self.text_column
+        )
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            classified = executor.submit(
+                self._cached,
+                "classification",
+                classification_key,
+                lambda classifier: self._classify(classifier, df),
+            )
+            geocoded = executor.submit(
+                self._cached,
+                "geocoding",
+                geocoding_key,
+                lambda geocoder: self._geocode(geocoder, df),
+            )
+            classified, geocoded = classified.result(), geocoded.result()
+
+        messages = geocoded.merge(
+            classified, left_on="index", right_index=True
+        ).dropna(subset="cats")
+        return messages, [classification_key, geocoding_key]
+
+    def run(
+        self,
+        df: pd.DataFrame,
+        filepath_to_population: str,
+        city_name: str,
+        city_crs: int,
+        min_event_size: int,
+    ):
+        """
+        Returns messages, events and connections of event detection
+        as EventDetection.run does, running only the stages whose
+        inputs or parameters changed since their output was cached.
+        """
+        messages, keys = self.prepare(df)
+        events_key = self._key(
+            "events",
+            keys,
+            population=self._hash_file(filepath_to_population),
+            city_name=city_name,
+            city_crs=city_crs,
+            min_event_size=min_event_size,
+        )
+        return self._cached(
+            "events",
+            events_key,
+            lambda event_model: event_model.run(
+                messages,
+                filepath_to_population,
+                city_name,
+                city_crs,
+                min_event_size,
+            ),
+        )
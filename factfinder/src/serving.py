@@ -0,0 +1,153 @@
+"""
+This module is aimed to serve single-text requests (classification,
+address extraction) from an asyncio web service with batched model calls.
+Requests are queued and flushed to the model as one batch when the batch
+is full or the oldest request has waited long enough.
+"""
+import asyncio
+import time
+from collections import deque
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    This class is aimed to collect single requests into batches.
+    batch_fn takes a list of items and returns the list of their results,
+    e.g. TextClassifier.run_batch or Geocoder.extract_ner_streets.
+    It runs in a worker thread, so the event loop keeps accepting requests
+    while the model is busy. Every caller gets the result of its own item,
+    an exception raised by batch_fn (or a ValueError if it returns
+    a wrong number of results) is passed to all callers of the batch,
+    and batching goes on with the next one.
+
+    Args:
+        batch_fn (callable): The function processing a batch.
+        max_batch_size (int): The maximum number of items in a batch.
+        max_wait (float): The maximum time in seconds a request waits
+            for other requests before its batch is flushed.
+        max_latencies (int): The number of the latest request latencies
+            kept for stats.
+    """
+
+    def __init__(
+        self,
+        batch_fn,
+        max_batch_size: int = 32,
+        max_wait: float = 0.01,
+        max_latencies: int = 10000,
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.latencies = deque(maxlen=max_latencies)
+        self.batches = 0
+        self.items = 0
+        self._queue = None
+        self._worker = None
+
+    async def start(self):
+        """
+        Start flushing batches in the running event loop.
+        """
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Process the requests already queued and stop.
+        """
+        if self._worker is None:
+            return
+        await self._queue.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def submit(self, item):
+        """
+        Queue an item and wait for its result.
+        """
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _next_batch(self) -> list:
+        """
+        Wait for a request, then collect more until the batch is full
+        or max_wait has passed since the first one.
+        """
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            items = [item for item, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(None, self.batch_fn, items)
+                error = None
+                if len(results) != len(items):
+                    raise ValueError(
+                        f"batch_fn returned {len(results)} results"
+                        f" for {len(items)} items"
+                    )
+            except Exception as e:
+                error = e
+            finished = time.perf_counter()
+            for i, (_, future, queued) in enumerate(batch):
+                if not future.done():
+                    if error is None:
+                        future.set_result(results[i])
+                    else:
+                        future.set_exception(error)
+                self.latencies.append(finished - queued)
+                self._queue.task_done()
+            self.batches += 1
+            self.items += len(batch)
+
+    def stats(self) -> dict:
+        """
+        Get the queue depth, the number of flushed batches and items,
+        the mean batch size and latencies of requests in seconds.
+        """
+        latencies = np.array(self.latencies)
+        percentiles = (
+            np.percentile(latencies, [50, 95, 100]).tolist()
+            if len(latencies)
+            else [None] * 3
+        )
+        return {
+            "queue_depth": 0 if self._queue is None else self._queue.qsize(),
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches
+            if self.batches
+            else None,
+            "latency_p50": percentiles[0],
+            "latency_p95": percentiles[1],
+            "latency_max": percentiles[2],
+        }
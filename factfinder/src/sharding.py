@@ -0,0 +1,295 @@
+"""
+This module is aimed to classify and geocode texts in shards, either in
+a pool of worker processes or on several machines sharing a directory.
+Input is split by a shard key (e.g. district or source file) or by
+a hash of texts, every shard is processed by a Pipeline and written
+with a marker file, and finished shards are merged deterministically
+into messages for EventDetection.
+"""
+import json
+import multiprocessing
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import pandas as pd
+import torch
+
+from .pipeline import Pipeline
+
+_worker_pipeline = None
+
+
+def _init_worker(pipeline: Pipeline, n_threads: int):
+    """
+    Keep one pipeline per worker process, so models are loaded
+    once per process rather than once per shard. Cores are shared
+    between workers instead of every worker using all of them.
+    """
+    global _worker_pipeline
+    _worker_pipeline = pipeline
+    torch.set_num_threads(n_threads)
+
+
+def _process_shard(shard_dir: str, shard: str) -> bool:
+    return ShardedRun(_worker_pipeline, shard_dir).process(shard)
+
+
+class ShardedRun:
+    """
+    This class is aimed to run classification and geocoding of a Pipeline
+    shard by shard. Shards live in shard_dir:
+
+        manifest.json               shard key and rows of every shard
+        shards/<shard>/input.pkl    texts of the shard
+        shards/<shard>/lock         host, pid and time of the worker
+                                    processing it
+        shards/<shard>/output.pkl   classified and geocoded messages
+        shards/<shard>/done.json    rows, time and host of the run
+
+    Several machines may call work() on the same directory, every shard
+    is processed by whoever locks it first. The lock of a worker which
+    crashed is stale: on the host of the worker, when its process is gone,
+    on other hosts, when it is older than lock_timeout seconds
+    (which should be longer than a shard takes). Shards with stale locks
+    are pending again and taken over by the next worker.
+
+    Args:
+        pipeline (Pipeline): The pipeline processing shards.
+        shard_dir (string): The directory shared by workers.
+        lock_timeout (float): The age in seconds of stale locks
+            of other hosts.
+    """
+
+    def __init__(
+        self, pipeline: Pipeline, shard_dir: str, lock_timeout: float = 3600
+    ):
+        self.pipeline = pipeline
+        self.shard_dir = shard_dir
+        self.manifest_path = os.path.join(shard_dir, "manifest.json")
+        self.lock_timeout = lock_timeout
+
+    def _path(self, shard: str, name: str) -> str:
+        return os.path.join(self.shard_dir, "shards", shard, name)
+
+    def _manifest(self) -> dict:
+        with open(self.manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def split(
+        self, df: pd.DataFrame, shard_key: str = None, n_shards: int = 8
+    ) -> list:
+        """
+        Split texts into shards by the values of the shard_key column,
+        or, if it is None, by a hash of texts into n_shards shards.
+        Messages get ids from their position in df, so ids do not depend
+        on sharding. Returns the shard names.
+        """
+        if os.path.exists(self.manifest_path):
+            raise FileExistsError(
+                f"{self.shard_dir} already holds shards, use a new directory"
+            )
+        df = df.reset_index(drop=True)
+        if "message_id" not in df.columns:
+            df["message_id"] = df.index
+        if shard_key is None:
+            values = (
+                pd.util.hash_pandas_object(
+                    df[self.pipeline.text_column], index=False
+                )
+                % n_shards
+            )
+        else:
+            values = df[shard_key]
+        manifest = {"shard_key": shard_key, "shards": {}}
+        for i, (value, shard_df) in enumerate(
+            df.groupby(values, sort=True, dropna=False)
+        ):
+            shard = f"{i:04d}"
+            os.makedirs(os.path.dirname(self._path(shard, "")), exist_ok=True)
+            shard_df.to_pickle(self._path(shard, "input.pkl"))
+            manifest["shards"][shard] = {
+                "value": str(value),
+                "rows": len(shard_df),
+            }
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        return list(manifest["shards"])
+
+    @staticmethod
+    def _read_lock(path: str) -> dict:
+        """
+        Get the host, pid and time of a lock, None if there is no lock.
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:  # being written or damaged
+            return {"time": os.path.getmtime(path)}
+
+    def _is_stale(self, shard: str, lock: dict) -> bool:
+        if os.path.exists(self._path(shard, "done.json")):
+            return False
+        if lock.get("host") == socket.gethostname() and "pid" in lock:
+            try:
+                os.kill(lock["pid"], 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:  # alive, owned by another user
+                return False
+            return False
+        return time.time() - lock["time"] > self.lock_timeout
+
+    def _release(self, shard: str, lock: dict) -> bool:
+        """
+        Remove a stale lock unless another worker has replaced it.
+        Returns whether it was removed.
+        """
+        path = self._path(shard, "lock")
+        stale_path = f"{path}.{socket.gethostname()}.{os.getpid()}"
+        try:
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            return False
+        if self._read_lock(stale_path) != lock:
+            # another worker took the shard meanwhile, give its lock back
+            os.rename(stale_path, path)
+            return False
+        os.remove(stale_path)
+        return True
+
+    def release_stale(self) -> list:
+        """
+        Remove stale locks. Returns the shards released.
+        """
+        released = []
+        for shard in self._manifest()["shards"]:
+            lock = self._read_lock(self._path(shard, "lock"))
+            if (
+                lock is not None
+                and self._is_stale(shard, lock)
+                and self._release(shard, lock)
+            ):
+                print(f"shard {shard}: stale lock of {lock} released")
+                released.append(shard)
+        return released
+
+    def pending(self) -> list:
+        """
+        Get the shards nobody has taken yet or whose worker crashed.
+        """
+        pending = []
+        for shard in self._manifest()["shards"]:
+            lock = self._read_lock(self._path(shard, "lock"))
+            if lock is None or self._is_stale(shard, lock):
+                pending.append(shard)
+        return pending
+
+    def _lock(self, shard: str) -> bool:
+        """
+        Take a shard, taking it over if its lock is stale.
+        Returns whether the shard was taken.
+        """
+        path = self._path(shard, "lock")
+        lock = self._read_lock(path)
+        if lock is not None and not (
+            self._is_stale(shard, lock) and self._release(shard, lock)
+        ):
+            return False
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        lock = {
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "time": time.time(),
+        }
+        os.write(fd, json.dumps(lock).encode("utf-8"))
+        os.close(fd)
+        return True
+
+    def process(self, shard: str) -> bool:
+        """
+        Classify and geocode a shard unless another worker has taken it.
+        Returns whether the shard was processed by this call.
+        """
+        if not self._lock(shard):
+            return False
+        start = time.perf_counter()
+        messages, _ = self.pipeline.prepare(
+            pd.read_pickle(self._path(shard, "input.pkl"))
+        )
+        messages.to_pickle(self._path(shard, "output.pkl"))
+        with open(self._path(shard, "done.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "rows": len(messages),
+                    "seconds": time.perf_counter() - start,
+                    "host": socket.gethostname(),
+                },
+                f,
+            )
+        print(f"shard {shard} done")
+        return True
+
+    def work(self, n_jobs: int = 1) -> int:
+        """
+        Process pending shards in n_jobs worker processes.
+        Returns the number of shards processed by this call.
+        """
+        shards = self.pending()
+        if n_jobs == 1:
+            return sum(self.process(shard) for shard in shards)
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.pipeline, max(1, (os.cpu_count() or 1) // n_jobs)),
+        ) as executor:
+            return sum(
+                executor.map(
+                    _process_shard, [self.shard_dir] * len(shards), shards
+                )
+            )
+
+    def merge(self) -> gpd.GeoDataFrame:
+        """
+        Merge the outputs of all shards ordered by message id, the result
+        does not depend on the number of shards or the order they
+        were processed in.
+        """
+        shards = list(self._manifest()["shards"])
+        missing = [
+            shard
+            for shard in shards
+            if not os.path.exists(self._path(shard, "done.json"))
+        ]
+        if missing:
+            raise RuntimeError(f"Shards not processed yet: {missing}")
+        messages = pd.concat(
+            [
+                pd.read_pickle(self._path(shard, "output.pkl"))
+                for shard in shards
+            ]
+        )
+        messages = messages.sort_values("message_id", kind="stable")
+        return gpd.GeoDataFrame(messages.reset_index(drop=True))
+
+    def run(
+        self,
+        df: pd.DataFrame,
+        shard_key: str = None,
+        n_shards: int = 8,
+        n_jobs: int = 1,
+    ) -> gpd.GeoDataFrame:
+        """
+        Split, process and merge shards in one call.
+        """
+        self.split(df, shard_key, n_shards)
+        self.work(n_jobs)
+        return self.merge()
@@ -0,0 +1,100 @@
+"""
+This module is aimed to store messages, events and connections
+as GeoParquet. Message ids and ids of representative docs of events
+are kept as native list<int64> columns, so they are read back
+as lists without parsing strings.
+It also reads input layers (e.g. buildings with population) keeping
+only the needed columns and features.
+"""
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+try:
+    import pyogrio
+except ImportError:  # optional, fiona is used instead
+    pyogrio = None
+
+OUTPUTS = ["messages", "events", "connections"]
+LIST_COLUMNS = {"events": ["message_ids", "docs"]}
+PARQUET_SUFFIXES = (".parquet", ".geoparquet")
+
+
+def read_layer(
+    path: str, columns: list, bbox: gpd.GeoSeries = None
+) -> gpd.GeoDataFrame:
+    """
+    Read the given columns and the geometry of a vector layer.
+    GeoParquet is read with pyarrow, other formats (GeoJSON, FlatGeobuf,
+    GeoPackage...) with pyogrio through Arrow if it is installed,
+    otherwise with fiona. If bbox is given, only features intersecting
+    its bounds are read. With pyogrio the index holds feature ids
+    of the file, so clipped features keep the ids they have in a full
+    read; fiona numbers the features read.
+    """
+    if path.lower().endswith(PARQUET_SUFFIXES):
+        layer = gpd.read_parquet(path, columns=[*columns, "geometry"])
+        if bbox is not None:
+            box = bbox.to_crs(layer.crs).unary_union
+            rows = layer.sindex.query(box, predicate="intersects")
+            layer = layer.iloc[np.sort(rows)]
+        return layer
+    if pyogrio is not None:
+        bounds = None
+        if bbox is not None:
+            crs = pyogrio.read_info(path)["crs"]
+            bounds = tuple(bbox.to_crs(crs or bbox.crs).total_bounds)
+        layer = pyogrio.read_dataframe(
+            path,
+            columns=columns,
+            bbox=bounds,
+            fid_as_index=True,
+            use_arrow=True,
+        )
+        layer.index.name = None
+        return layer
+    layer = gpd.read_file(path, bbox=bbox)
+    return layer[[*columns, "geometry"]]
+
+
+def _to_int_lists(series: pd.Series) -> pd.Series:
+    """
+    Convert ids to Python ints, so Arrow infers list<int64> for them.
+    """
+    return series.map(lambda values: [int(value) for value in values])
+
+
+def write_outputs(
+    directory: str,
+    messages: gpd.GeoDataFrame,
+    events: gpd.GeoDataFrame,
+    connections: gpd.GeoDataFrame,
+    prefix: str = "",
+):
+    """
+    Write the outputs of event detection to <prefix><name>.parquet files
+    in directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, frame in zip(OUTPUTS, [messages, events, connections]):
+        frame = frame.copy()
+        for column in LIST_COLUMNS.get(name, []):
+            frame[column] = _to_int_lists(frame[column])
+        frame.to_parquet(os.path.join(directory, f"{prefix}{name}.parquet"))
+
+
+def read_outputs(directory: str, prefix: str = "") -> tuple:
+    """
+    Read messages, events and connections written by write_outputs.
+    """
+    outputs = []
+    for name in OUTPUTS:
+        frame = gpd.read_parquet(
+            os.path.join(directory, f"{prefix}{name}.parquet")
+        )
+        for column in LIST_COLUMNS.get(name, []):
+            frame[column] = frame[column].map(lambda x: x.tolist())
+        outputs.append(frame)
+    return tuple(outputs)
@@ -1,10 +1,19 @@
 import pandas as pd
 from transformers import pipeline
 
+from .cascade import CascadeModel
+from .instrumentation import Instrumentation
+from .model_registry import ModelRegistry, default_registry
+
 
 class TextClassifier:
     """
     This class is aimed to classify input texts into categories, or city functions. It uses a Huggingface transformer model trained on rubert-tiny
+    The model is taken from the registry (the process-wide one if None),
+    so classifiers of a process share it.
+    With cascade (a CascadeModel or the path it is saved to) texts are
+    classified by the cheap cascade model first, only texts it gives
+    a probability below cascade_threshold are passed to the transformer.
     """
 
     def __init__(
@@ -12,16 +21,32 @@ class TextClassifier:
         repository_id="Sandrro/text_to_function_v2",
         number_of_categories=1,
         device_type=None,
+        instrumentation: Instrumentation = None,
+        registry: ModelRegistry = None,
+        cascade=None,
+        cascade_threshold: float = 0.9,
     ):
+        if instrumentation is None:
+            instrumentation = Instrumentation()
+        self.instrumentation = instrumentation
         self.REP_ID = repository_id
         self.CATS_NUM = number_of_categories
-        self.classifier = pipeline(
-            "text-classification",
-            model=self.REP_ID,
-            tokenizer="cointegrated/rubert-tiny2",
-            max_length=2048,
-            truncation=True,
+        if isinstance(cascade, str):
+            cascade = CascadeModel.load(cascade)
+        self.cascade = cascade
+        self.cascade_threshold = cascade_threshold
+        self.classifier = (registry or default_registry).get(
+            self.REP_ID,
+            lambda: pipeline(
+                "text-classification",
+                model=self.REP_ID,
+                tokenizer="cointegrated/rubert-tiny2",
+                max_length=2048,
+                truncation=True,
+                device=device_type,
+            ),
             device=device_type,
+            backend="text-classification",
         )
 
     def run(self, t):
@@ -31,16 +56,55 @@ class TextClassifier:
         :return: list of predicted categories and probabilities
         """
         if isinstance(t, str):
-            preds = pd.DataFrame(self.classifier(t, top_k=self.CATS_NUM))
+            self.instrumentation.count("classified_texts")
+            if self.cascade is not None:
+                preds, confidence = self.cascade.predict([t], self.CATS_NUM)
+                if confidence[0] >= self.cascade_threshold:
+                    self.instrumentation.count("cascade_hits")
+                    return self._format(preds[0])
+            preds = self.classifier(t, top_k=self.CATS_NUM)
             self.classifier.call_count = 0
-            if self.CATS_NUM > 1:
-                cats = "; ".join(preds["label"].tolist())
-                probs = "; ".join(preds["score"].round(3).astype(str).tolist())
-            else:
-                cats = preds["label"][0]
-                probs = preds["score"].round(3).astype(str)[0]
+            return self._format(preds)
+        print("text is not string")
+        return [None, None]
+
+    def _format(self, preds) -> list:
+        preds = pd.DataFrame(preds)
+        if self.CATS_NUM > 1:
+            cats = "; ".join(preds["label"].tolist())
+            probs = "; ".join(preds["score"].round(3).astype(str).tolist())
         else:
-            print("text is not string")
-            cats = None
-            probs = None
+            cats = preds["label"][0]
+            probs = preds["score"].round(3).astype(str)[0]
         return [cats, probs]
+
+    def run_batch(self, texts: list, batch_size: int = 32) -> list:
+        """
+        This method classifies several texts with batched forward passes.
+        :param texts: texts to classify
+        :param batch_size: the number of texts in a forward pass
+        :return: list of predicted categories and probabilities of every text
+        """
+        results = [[None, None] for _ in texts]
+        strings = [i for i, t in enumerate(texts) if isinstance(t, str)]
+        self.instrumentation.count("classified_texts", len(strings))
+        if strings and self.cascade is not None:
+            preds, confidence = self.cascade.predict(
+                [texts[i] for i in strings], self.CATS_NUM
+            )
+            confident = confidence >= self.cascade_threshold
+            for i, text_preds, hit in zip(strings, preds, confident):
+                if hit:
+                    results[i] = self._format(text_preds)
+            self.instrumentation.count("cascade_hits", int(confident.sum()))
+            strings = [i for i, hit in zip(strings, confident) if not hit]
+        if strings:
+            preds = self.classifier(
+                [texts[i] for i in strings],
+                top_k=self.CATS_NUM,
+                batch_size=batch_size,
+            )
+            self.classifier.call_count = 0
+            for i, text_preds in zip(strings, preds):
+                results[i] = self._format(text_preds)
+        return results
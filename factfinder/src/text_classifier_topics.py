@@ -1,11 +1,16 @@
 import pandas as pd
 from transformers import pipeline
 
+from .instrumentation import Instrumentation
+from .model_registry import ModelRegistry, default_registry
+
 
 class TextClassifierTopics:
     """
     This class is aimed to classify input texts into themes, or structured types of events. It uses a Huggingface transformer model trained on rubert-tiny.
     In many cases count of messages per theme was too low to efficiently train, so we used synthetic themes based on the categories as upper level (for example, 'unknown_ЖКХ')
+    The model is taken from the registry (the process-wide one if None),
+    so classifiers of a process share it.
     """
 
     def __init__(
@@ -13,16 +18,26 @@ class TextClassifierTopics:
         repository_id="Sandrro/text_to_subfunction_v10",
         number_of_categories=1,
         device_type=None,
+        instrumentation: Instrumentation = None,
+        registry: ModelRegistry = None,
     ):
+        if instrumentation is None:
+            instrumentation = Instrumentation()
+        self.instrumentation = instrumentation
         self.REP_ID = repository_id
         self.CATS_NUM = number_of_categories
-        self.classifier = pipeline(
-            "text-classification",
-            model=self.REP_ID,
-            tokenizer="cointegrated/rubert-tiny2",
-            max_length=2048,
-            truncation=True,
+        self.classifier = (registry or default_registry).get(
+            self.REP_ID,
+            lambda: pipeline(
+                "text-classification",
+                model=self.REP_ID,
+                tokenizer="cointegrated/rubert-tiny2",
+                max_length=2048,
+                truncation=True,
+                device=device_type,
+            ),
             device=device_type,
+            backend="text-classification",
         )
 
     def run(self, t):
@@ -31,8 +46,13 @@ class TextClassifierTopics:
         :param t: text to classify
         :return: list of predicted themes and probabilities
         """
-        preds = pd.DataFrame(self.classifier(t, top_k=self.CATS_NUM))
+        preds = self.classifier(t, top_k=self.CATS_NUM)
         self.classifier.call_count = 0
+        self.instrumentation.count("classified_texts")
+        return self._format(preds)
+
+    def _format(self, preds) -> list:
+        preds = pd.DataFrame(preds)
         if self.CATS_NUM > 1:
             cats = "; ".join(preds["label"].tolist())
             probs = "; ".join(preds["score"].round(3).astype(str).tolist())
@@ -40,3 +60,17 @@ class TextClassifierTopics:
             cats = preds["label"][0]
             probs = preds["score"].round(3).astype(str)[0]
         return [cats, probs]
+
+    def run_batch(self, texts: list, batch_size: int = 32) -> list:
+        """
+        This method classifies several texts with batched forward passes.
+        :param texts: texts to classify
+        :param batch_size: the number of texts in a forward pass
+        :return: list of predicted themes and probabilities of every text
+        """
+        preds = self.classifier(
+            list(texts), top_k=self.CATS_NUM, batch_size=batch_size
+        )
+        self.classifier.call_count = 0
+        self.instrumentation.count("classified_texts", len(texts))
+        return [self._format(text_preds) for text_preds in preds]
@@ -0,0 +1,93 @@
+import numpy as np
+
+from factfinder import CascadeModel, Instrumentation, TextClassifier
+
+TEXTS = {
+    "ЖКХ": ["нет горячей воды в доме", "протекает крыша подъезда"],
+    "Благоустройство": ["сломана детская площадка", "мусор во дворе"],
+    "Дороги": ["яма на дороге у остановки", "не убран снег на дороге"],
+}
+
+
+def labelled_texts(repeats=5):
+    texts, labels = [], []
+    for label, samples in TEXTS.items():
+        for i in range(repeats):
+            for sample in samples:
+                texts.append(f"{sample} {i}")
+                labels.append(label)
+    return texts, labels
+
+
+class FakePipeline:
+    def __init__(self):
+        self.texts = []
+        self.call_count = 0
+
+    def __call__(self, texts, top_k=1, batch_size=None):
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        self.texts.extend(batch)
+        preds = [[{"label": "Дороги", "score": 0.5}] for _ in batch]
+        return preds[0] if single else preds
+
+
+def make_classifier(cascade, threshold):
+    classifier = TextClassifier.__new__(TextClassifier)
+    classifier.instrumentation = Instrumentation()
+    classifier.CATS_NUM = 1
+    classifier.cascade = cascade
+    classifier.cascade_threshold = threshold
+    classifier.classifier = FakePipeline()
+    return classifier
+
+
+def test_cascade_fit_predict_and_persist(tmp_path):
+    texts, labels = labelled_texts()
+    model = CascadeModel(n_features=2**12).fit(texts, labels)
+    preds, confidence = model.predict(["яма на дороге", "мусор во дворе"], 2)
+    assert [p[0]["label"] for p in preds] == ["Дороги", "Благоустройство"]
+    assert all(len(p) == 2 for p in preds)
+    assert confidence.dtype == np.float32
+    path = str(tmp_path / "cascade.joblib")
+    model.save(path)
+    _, loaded_confidence = CascadeModel.load(path).predict(
+        ["яма на дороге", "мусор во дворе"], 2
+    )
+    np.testing.assert_array_equal(confidence, loaded_confidence)
+
+
+def test_cascade_coverage_report():
+    texts, labels = labelled_texts()
+    model = CascadeModel(n_features=2**12).fit(texts, labels)
+    report = model.coverage_report(texts, labels, thresholds=[0.0, 0.5, 1.0])
+    assert list(report.columns) == [
+        "threshold",
+        "coverage",
+        "accuracy",
+        "cascade_accuracy",
+    ]
+    assert report.coverage.iloc[0] == 1
+    assert report.coverage.is_monotonic_decreasing
+    assert (report.cascade_accuracy >= report.accuracy.fillna(0)).all()
+
+
+def test_cascade_distilled_and_skips_transformer():
+    texts, labels = labelled_texts()
+    teacher = make_classifier(None, 0.9)
+    teacher.run_batch = lambda texts, batch_size: [
+        [label, "0.9"] for label in labels
+    ]
+    model = CascadeModel.distill(teacher, texts, n_features=2**12)
+    assert set(model.classifier.classes_) == set(TEXTS)
+
+    classifier = make_classifier(model, 0.95)
+    results = classifier.run_batch(["мусор во дворе", "xyz 123", None])
+    assert results[0][0] == "Благоустройство"
+    assert results[1] == ["Дороги", "0.5"]
+    assert results[2] == [None, None]
+    assert classifier.classifier.texts == ["xyz 123"]
+    assert classifier.instrumentation.counters["cascade_hits"] == 1
+    assert classifier.run("мусор во дворе")[0] == "Благоустройство"
+    assert classifier.classifier.texts == ["xyz 123"]
+    assert classifier.instrumentation.counters["classified_texts"] == 3
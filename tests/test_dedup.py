@@ -0,0 +1,14 @@
+from factfinder.src.dedup import near_duplicate_groups
+
+
+def test_near_duplicate_groups():
+    texts = [
+        "Яма на дороге у дома 5!!!",
+        "Мусор не вывозят уже неделю",
+        "яма на дороге у дома 5",
+        "нет горячей воды",
+        "Мусор не вывозят уже неделю.",
+        "",
+    ]
+    assert near_duplicate_groups(texts).tolist() == [0, 1, 0, 2, 1, 3]
+    assert near_duplicate_groups([]).tolist() == []
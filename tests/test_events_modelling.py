@@ -1,30 +1,619 @@
+import json
+import numpy as np
 import pytest
 import torch
 import geopandas as gpd
 import pandas as pd
-from shapely import Point
+from bertopic import BERTopic
+from shapely import LineString, Point
 from factfinder import EventDetection
+from factfinder.src import event_detection
+from factfinder.src.event_detection import (
+    LinkIndex,
+    ModelStore,
+    _cluster_object,
+    _RowVectorizer,
+    _stable_topics,
+)
 
 path_to_population = "data/raw/population.geojson"
 path_to_data = "data/processed/messages.geojson"
 
+
 @pytest.fixture
 def gdf():
     gdf = gpd.read_file(path_to_data)
     gdf = gdf.head(6)
     return gdf
 
+
 def test_event_detection(gdf):
     expected_name = "0_фурштатская_штукатурного слоя_слоя_отслоение"
     expected_risk = 0.405
     expected_messages = [4, 5, 3, 2]
     event_model = EventDetection()
     messages, events, connections = event_model.run(
-        gdf, path_to_population, 'Санкт-Петербург', 32636, min_event_size=3
-        )
-    event_name = events.iloc[0]['name']
-    event_risk = events.iloc[0]['risk'].round(3)
-    event_messages = [int(mid) for mid in events.iloc[0]['message_ids'].split(', ')]
+        gdf, path_to_population, "Санкт-Петербург", 32636, min_event_size=3
+    )
+    event_name = events.iloc[0]["name"]
+    event_risk = events.iloc[0]["risk"].round(3)
+    event_messages = events.iloc[0]["message_ids"]
     assert event_name == expected_name
     assert event_risk == expected_risk
-    assert all(mid in event_messages for mid in expected_messages)
\ No newline at end of file
+    assert all(mid in event_messages for mid in expected_messages)
+
+
+def test_event_connections_count_shared_messages():
+    event_model = EventDetection()
+    event_model.events = gpd.GeoDataFrame(
+        {
+            "id": ["0_global_0", "0_road_1", "0_link_2"],
+            "message_ids": [[1, 2], [12, 21], [2, 3]],
+        },
+        geometry=[Point(30.3, 59.9), Point(30.31, 59.91), Point(30.32, 59.92)],
+        crs=4326,
+    )
+    connections = event_model._get_event_connections()
+    # 1, 2 and 12, 21 share digits but not messages
+    assert connections[["a", "b", "weight"]].values.tolist() == [
+        ["0_global_0", "0_link_2", 1]
+    ]
+    assert connections.crs == event_model.events.crs
+
+
+def test_parallel_clustering_matches_serial(monkeypatch):
+    rng = np.random.default_rng(42)
+    themes = ["яма на дороге", "мусор во дворе", "нет горячей воды"]
+    texts, vectors = [], []
+    for i in range(60):
+        theme = i % len(themes)
+        texts.append(f"{themes[theme]} дом {i}")
+        vectors.append(rng.normal(theme * 5, 0.5, 16))
+    embeddings = dict(zip(texts, vectors))
+    messages = pd.DataFrame(
+        {"text": texts, "road_id": [i % 2 for i in range(60)]}
+    )
+    messages.loc[57:, "road_id"] = 2
+    objects = [
+        ("road", oid, local) for oid, local in messages.groupby("road_id")
+    ]
+
+    results = []
+    for n_jobs in [1, 2]:
+        event_model = EventDetection(n_jobs=n_jobs)
+        event_model.messages = messages
+        monkeypatch.setattr(
+            event_model,
+            "_embed_texts",
+            lambda x: np.array([embeddings[text] for text in x]),
+        )
+        results.append(event_model._cluster_objects(objects, 3))
+
+    serial, parallel = results
+    assert serial[2] is None and parallel[2] is None
+    for (serial_info, serial_topics), (parallel_info, parallel_topics) in zip(
+        serial[:2], parallel[:2]
+    ):
+        pd.testing.assert_frame_equal(serial_info, parallel_info)
+        assert list(serial_topics) == list(parallel_topics)
+
+
+def test_n_jobs_validation():
+    with pytest.raises(ValueError):
+        EventDetection(n_jobs=0)
+    assert EventDetection(n_jobs=-1).n_jobs >= 1
+
+
+def test_event_attributes_match_per_event_selection():
+    messages = gpd.GeoDataFrame(
+        {
+            "message_id": [1, 2, 3, 4, 4, 5],
+            "date_time": [
+                "2023.01.26 16:32",
+                "2023.01.20 10:00",
+                "2023.02.26 16:32",
+                "2023.01.01 00:00",
+                "2023.01.01 00:00",
+                "2023.03.01 00:00",
+            ],
+            "cats": ["ЖКХ", "Дороги", "Дороги", "ЖКХ", "ЖКХ", "Транспорт"],
+            "importance": [0.2, 0.18, 0.18, 0.2, 0.2, 0.17],
+        },
+        geometry=[
+            Point(30.30, 59.90),
+            Point(30.31, 59.91),
+            Point(30.32, 59.92),
+            Point(30.33, 59.93),
+            Point(30.34, 59.94),
+            Point(30.35, 59.95),
+        ],
+        crs=4326,
+    )
+    # message 4 is duplicated, as after the joins with buildings and links
+    assignments = pd.DataFrame(
+        {
+            "id": ["0_link_1", "0_link_1", "1_link_1", "1_link_1", "0_road_2"],
+            "message_id": [1, 2, 3, 4, 5],
+        }
+    )
+    attributes = EventDetection()._event_attributes(assignments, messages)
+
+    assert attributes.loc["0_link_1", "category"] == "Дороги, ЖКХ"
+    assert attributes.loc["1_link_1", "category"] == "ЖКХ"
+    assert attributes.loc["0_link_1", "duration"] == 6
+    assert attributes.loc["1_link_1", "duration"] == 56
+    assert attributes.loc["0_road_2", "duration"] == 0
+    for event_id, event_messages in assignments.groupby("id").message_id:
+        selected = messages[messages.message_id.isin(event_messages)]
+        assert attributes.loc[event_id, "importance"] == pytest.approx(
+            selected.importance.mean()
+        )
+        assert attributes.loc[event_id, "geometry"].equals(
+            selected.geometry.unary_union.representative_point()
+        )
+
+
+def test_rebalance_population():
+    events = pd.DataFrame(
+        {
+            "id": ["g", "r", "r2", "l", "b"],
+            "level": ["global", "road", "road", "link", "building"],
+            "population": [1000, 300, 50, 100, 40],
+        }
+    )
+    connections = pd.DataFrame(
+        [
+            ["g", "r"],
+            ["g", "l"],
+            ["g", "r2"],
+            ["r", "l"],
+            ["r", "b"],
+            ["r2", "l"],
+            ["l", "b"],
+        ],
+        columns=["a", "b"],
+    )
+    rebalanced = EventDetection()._rebalance(events, connections)
+    # "r2" accounts for more than it has, so incoming connections are used
+    assert rebalanced.tolist() == [550, 160, 50, 60, 40]
+
+
+def test_roads_cache(tmp_path, monkeypatch):
+    links = gpd.GeoDataFrame(
+        {"link_id": [0, 1], "name": ["Садовая улица", None]},
+        geometry=[
+            Point(30.3, 59.9).buffer(0.001),
+            Point(30.4, 59.9).buffer(0.001),
+        ],
+        crs=4326,
+    )
+    links["road_id"] = links["name"].map({"Садовая улица": 0})
+    downloads = []
+
+    def download_roads(city_name, city_crs):
+        downloads.append(city_name)
+        return links
+
+    event_model = EventDetection(roads_cache_dir=tmp_path)
+    monkeypatch.setattr(event_model, "_download_roads", download_roads)
+    event_model._get_roads("Санкт-Петербург", 32636)
+    cached = event_model._get_roads("Санкт-Петербург", 32636)
+    event_model._get_roads("Санкт-Петербург", 32636, refresh=True)
+    assert downloads == ["Санкт-Петербург", "Санкт-Петербург"]
+    pd.testing.assert_frame_equal(pd.DataFrame(cached), pd.DataFrame(links))
+
+    offline_model = EventDetection(roads_cache_dir=tmp_path, offline=True)
+    assert len(offline_model._get_roads("Санкт-Петербург", 32636)) == 2
+    with pytest.raises(FileNotFoundError):
+        offline_model._get_roads("Москва", 32637)
+
+
+def test_buildings_clipped_and_cached(tmp_path, monkeypatch):
+    links = gpd.GeoDataFrame(
+        {"link_id": [0], "name": ["Садовая улица"], "road_id": [0]},
+        geometry=[LineString([(0, 0), (100, 0)])],
+        crs=32636,
+    )
+    buildings = gpd.GeoDataFrame(
+        {
+            "address": ["near", "far", "close"],
+            "building_id": [7, 8, 9],
+            "population_balanced": [10, 20, 30],
+        },
+        geometry=gpd.GeoSeries(
+            [Point(50, 10), Point(5000, 5000), Point(50, -300)], crs=32636
+        ).to_crs(4326),
+        crs=4326,
+    )
+    population_filepath = str(tmp_path / "population.geojson")
+    buildings.to_file(population_filepath)
+
+    event_model = EventDetection(
+        buildings_cache_dir=str(tmp_path / "cache"), clip_buildings=True
+    )
+    event_model.population_filepath = population_filepath
+    event_model.links = links
+    event_model.link_index = LinkIndex(links)
+    read = event_model._get_buildings()
+    assert read.address.tolist() == ["near", "close"]
+    assert read.building_id.tolist() == [0, 2]
+    assert read.link_id.tolist()[0] == 0
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+
+    def read_layer(*args):
+        raise AssertionError("the cached layer should be read")
+
+    monkeypatch.setattr(event_detection, "read_layer", read_layer)
+    cached = event_model._read_buildings()
+    assert cached.address.tolist() == ["near", "close"]
+
+
+def test_link_index_nearest_within_distance():
+    links = gpd.GeoDataFrame(
+        {"link_id": [0, 1], "name": ["Садовая улица", None]},
+        geometry=[
+            LineString([(0, 0), (100, 0)]),
+            LineString([(0, 50), (100, 50)]),
+        ],
+        crs=32636,
+    )
+    links["road_id"] = links["name"].map({"Садовая улица": 0})
+    points = gpd.GeoSeries(
+        [Point(50, 5), Point(50, 46), Point(50, 25), Point(500, 500)],
+        crs=32636,
+    ).to_crs(4326)
+    assigned = LinkIndex(links).nearest(points, max_distance=7)
+    assert assigned.link_id.tolist()[:2] == [0, 1]
+    assert assigned.road_id.tolist()[0] == 0
+    assert assigned.iloc[1:].road_id.isna().all()
+    assert assigned.iloc[2:].link_id.isna().all()
+
+
+@pytest.fixture
+def themed_messages():
+    rng = np.random.default_rng(42)
+    themes = ["яма на дороге", "мусор во дворе", "нет горячей воды"]
+    texts, vectors = [], []
+    for i in range(75):
+        theme = i % len(themes)
+        texts.append(f"{themes[theme]} дом {i}")
+        vector = rng.normal(0, 0.1, 16)
+        vector[theme] += 1
+        vectors.append(vector)
+    embeddings = dict(zip(texts, vectors))
+    messages = pd.DataFrame({"message_id": range(75), "text": texts})
+    return messages, lambda x: np.array([embeddings[text] for text in x])
+
+
+def test_new_messages_assigned_without_refit(themed_messages, monkeypatch):
+    messages, embed_texts = themed_messages
+    event_model = EventDetection(keep_models=True)
+    embedded = []
+
+    def record_embed_texts(texts):
+        embedded.extend(texts)
+        return embed_texts(texts)
+
+    monkeypatch.setattr(event_model, "_embed_texts", record_embed_texts)
+    old_messages = messages.iloc[:60]
+    [(topic_info, topics)] = event_model._cluster_objects(
+        [("road", 1, old_messages)], 3
+    )
+    event_model.object_clusters[("road", 1)] = (
+        topic_info,
+        old_messages.message_id.tolist(),
+        topics,
+    )
+
+    assert event_model._assign_to_events(
+        "road", 1, messages.iloc[60:66], min_share=0.2, max_outliers=0.5
+    )
+    old_topics = topics
+    topic_info, message_ids, topics = event_model.object_clusters[("road", 1)]
+    assert message_ids == list(range(66))
+    assert topics[:60] == old_topics and len(topics) == 66
+    assert topic_info.Count.sum() == sum(
+        topic in topic_info.Topic.values for topic in topics
+    )
+    # texts are embedded once, however many objects they are assigned to
+    event_model.classify(messages.text.iloc[60:66].tolist(), "road", 1)
+    assert len(embedded) == len(set(embedded)) == 66
+    # too many new messages at once, the object has to be refitted
+    assert not event_model._assign_to_events(
+        "road", 1, messages.iloc[66:], min_share=0.1, max_outliers=0.5
+    )
+
+
+def test_model_store_classify(themed_messages, tmp_path, monkeypatch):
+    messages, embed_texts = themed_messages
+    event_model = EventDetection(models_dir=str(tmp_path))
+    monkeypatch.setattr(event_model, "_embed_texts", embed_texts)
+    [(topic_info, _)] = event_model._cluster_objects(
+        [("road", 1.0, messages.iloc[:60])], 3
+    )
+    assert event_model.models == {}
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    assert list(manifest) == ["road/1.0"]
+    assert manifest["road/1.0"]["data_hash"] == ModelStore.data_hash(
+        messages.text.iloc[:60].tolist()
+    )
+
+    # a new instance reads only the model it is asked for
+    query_model = EventDetection(models_dir=str(tmp_path))
+    monkeypatch.setattr(query_model, "_embed_texts", embed_texts)
+    classified = query_model.classify(
+        messages.text.iloc[60:].tolist(), "road", 1.0
+    )
+    assert len(classified) == 15
+    assert set(classified.topic) <= set(topic_info.Topic)
+    assert classified.id.str.endswith("_road_1.0").all()
+    with pytest.raises(ValueError):
+        query_model.classify(["текст"], "road", 2.0)
+
+    # the store is refitted on other texts by another detector,
+    # the first one rejects the stale model of its object
+    assert list(tmp_path.glob("*.tmp")) == []
+    other_model = EventDetection(models_dir=str(tmp_path))
+    monkeypatch.setattr(other_model, "_embed_texts", embed_texts)
+    other_model._cluster_objects([("road", 1.0, messages.iloc[15:])], 3)
+    event_model.model_store = ModelStore(str(tmp_path))
+    assert event_model._get_model("road", 1.0) is None
+    assert (
+        EventDetection(models_dir=str(tmp_path))._get_model("road", 1.0)
+        is not None
+    )
+
+
+def test_object_without_terms_makes_one_topic():
+    rng = np.random.default_rng(0)
+    docs = ["!!!", "?", "...", "))", "((", "--"] * 3
+    embeddings = rng.normal(size=(len(docs), 16))
+    topic_info, topics, problem, _, _ = _cluster_object(
+        docs, embeddings, 3, small_object_size=50
+    )
+    assert "empty vocabulary" in problem
+    assert topics == [0] * len(docs)
+    assert topic_info.Count.tolist() == [len(docs)]
+
+
+def test_small_objects_skip_umap(themed_messages, monkeypatch):
+    messages, embed_texts = themed_messages
+    objects = [("link", 1.0, messages.iloc[:30])]
+    clusters = {}
+    for small_object_size in [None, 50]:
+        event_model = EventDetection(small_object_size=small_object_size)
+        monkeypatch.setattr(event_model, "_embed_texts", embed_texts)
+        [clusters[small_object_size]] = event_model._cluster_objects(objects, 3)
+    [timing] = event_model.instrumentation.object_timings
+    assert (timing["level"], timing["texts"]) == ("link", 30)
+    assert event_model.instrumentation.counters["objects_clustered"] == 1
+    topic_info, topics = clusters[50]
+    assert list(topic_info.columns) == list(clusters[None][0].columns)
+    assert topic_info.Count.sum() == 30
+    # texts of one theme end up in one topic
+    themes = np.arange(30) % 3
+    assert pd.Series(topics).groupby(themes).nunique().eq(1).all()
+    assert len(set(topics)) == 3
+
+
+def test_time_windows_and_stitching():
+    dates = pd.to_datetime(pd.Series(["2021-01-01", "2021-03-15"]))
+    windows = EventDetection._time_windows(dates, "30D", "10D")
+    assert len(windows) == 4
+    assert windows[1][0] == pd.Timestamp("2021-01-21")
+    assert windows[-1][1] > dates.max()
+    with pytest.raises(ValueError):
+        EventDetection._time_windows(dates, "30D", "30D")
+
+    window_events = pd.DataFrame(
+        {
+            "window": [0, 0, 1, 1, 2],
+            "id": [
+                "0_road_1.0",
+                "1_road_1.0",
+                "0_road_1.0",
+                "0_road_2.0",
+                "3_road_1.0",
+            ],
+            "message_ids": [[1, 2, 3], [4, 5], [2, 3, 4], [5, 6], [3, 7]],
+        }
+    )
+    stitched = EventDetection._stitch_windows(window_events)
+    assert stitched.event_id.tolist() == [
+        "0_0_road_1.0",
+        "0_1_road_1.0",
+        "0_0_road_1.0",
+        "1_0_road_2.0",
+        "0_0_road_1.0",
+    ]
+
+
+def test_shared_document_term_matrix():
+    texts = ["яма на дороге", "яма во дворе", "мусор во дворе"]
+    event_model = EventDetection(min_df=2)
+    event_model._count_terms(set(texts))
+    assert sorted(event_model.terms) == ["во", "во дворе", "дворе", "яма"]
+
+    rows, vocabulary = event_model._object_terms(texts[:2])
+    assert sorted(vocabulary) == ["во", "во дворе", "дворе", "яма"]
+    vectorizer = _RowVectorizer(vocabulary=vocabulary)
+    vectorizer.rows = rows
+    counts = vectorizer.fit_transform(["d0 d1", "d1"]).toarray()
+    assert counts[0, vocabulary["яма"]] == 2
+    assert counts[1].sum() == 4
+    # terms of texts added later extend the vocabulary if frequent enough
+    event_model._count_terms({"яма во дворе дома"})
+    assert event_model.document_terms.shape == (4, 4)
+    event_model._count_terms({"сломан лифт", "сломан свет"})
+    assert event_model.document_terms.shape == (6, 5)
+    assert event_model.terms[-1] == "сломан"
+    assert event_model._object_terms(["сломан лифт"])[1] == {"сломан": 0}
+    assert event_model._object_terms(["яма на дороге"])[0].sum() == 1
+
+
+def test_runs_fit_own_vocabulary(monkeypatch):
+    rng = np.random.default_rng(42)
+    runs = [
+        ["яма на дороге", "мусор во дворе", "нет горячей воды"],
+        ["сломан лифт", "шумят соседи ночью", "течет кран"],
+    ]
+    embeddings = {}
+    for themes in runs:
+        for i in range(60):
+            vector = rng.normal(0, 0.1, 16)
+            vector[i % 3] += 1
+            embeddings[f"{themes[i % 3]} {i}"] = vector
+    event_model = EventDetection()
+    monkeypatch.setattr(
+        event_model,
+        "_embed_texts",
+        lambda texts: np.array([embeddings[text] for text in texts]),
+    )
+    monkeypatch.setattr(event_model, "_load_city", lambda *args: None)
+    monkeypatch.setattr(event_model, "_preprocess", lambda messages: messages)
+    monkeypatch.setattr(event_model, "_connect_events", lambda: None)
+    event_model.connections = None
+
+    def get_events(min_event_size):
+        [(topic_info, _)] = event_model._cluster_objects(
+            [("global", 0, event_model.messages)], min_event_size
+        )
+        return topic_info
+
+    monkeypatch.setattr(event_model, "_get_events", get_events)
+    for themes in runs:
+        texts = [f"{themes[i % 3]} {i}" for i in range(60)]
+        messages = pd.DataFrame({"message_id": range(60), "text": texts})
+        _, events, _ = event_model.run(messages, None, "city", 32636, 3)
+        words = {word for theme in themes for word in theme.split()}
+        # the vocabulary is made of the terms of this run only
+        assert {
+            word for term in event_model.terms for word in term.split()
+        } <= words | {str(i) for i in range(60)}
+        names = " ".join(events[events.Topic != -1].Name)
+        assert any(word in names for word in words)
+    assert "лифт" in event_model.terms and "яма" not in event_model.terms
+
+
+def test_hierarchical_mode_derives_finer_levels(themed_messages, monkeypatch):
+    messages, embed_texts = themed_messages
+    messages = messages.assign(
+        global_id=0,
+        road_id=[0.0] * 45 + [1.0] * 30,
+        link_id=[0.0] * 20 + [1.0] * 25 + [2.0] * 30,
+        building_id=[0.0] * 6 + [np.nan] * 69,
+    )
+    event_model = EventDetection(hierarchical=True)
+    monkeypatch.setattr(event_model, "_embed_texts", embed_texts)
+    event_model._fit_hierarchy(messages, 3)
+    counters = event_model.instrumentation.counters
+    assert counters["objects_clustered"] == 1
+    assert counters["objects_derived"] == 6
+
+    global_info, _, global_topics = event_model.object_clusters[("global", 0)]
+    global_topic = dict(zip(messages.message_id, global_topics))
+    for (level, oid), clustering in event_model.object_clusters.items():
+        topic_info, message_ids, topics = clustering
+        assert topic_info.Count.sum() == len(topics) == len(message_ids)
+        # messages share a derived event only if they share a global one
+        pairs = {
+            (topic, global_topic[m]) for m, topic in zip(message_ids, topics)
+        }
+        derived = [topic for topic, _ in pairs if topic != -1]
+        assert len(derived) == len(set(derived))
+    # themes alternate, so each building message is alone in its theme
+    building_info, _, building_topics = event_model.object_clusters[
+        ("building", 0.0)
+    ]
+    assert set(building_topics) == {-1}
+    assert building_info.Name.tolist() == ["-1_outliers"]
+
+    refit_model = EventDetection(hierarchical=True, refit_size=40)
+    monkeypatch.setattr(refit_model, "_embed_texts", embed_texts)
+    refit_model._fit_hierarchy(messages, 3)
+    assert refit_model.instrumentation.counters["objects_clustered"] == 2
+
+
+def test_fast_mode_stable_topics(themed_messages, tmp_path, monkeypatch):
+    with pytest.raises(ValueError):
+        EventDetection(mode="parallel")
+    topic_info = pd.DataFrame({"Topic": [-1, 0, 1, 2]})
+    # the same clusters numbered in another order get the same ids
+    for topics in [[2, 0, 0, 1, 1, -1, 2], [1, 2, 2, 0, 0, -1, 1]]:
+        mapping = _stable_topics(topic_info, topics)
+        assert [mapping[topic] for topic in topics] == [0, 1, 1, 2, 2, -1, 0]
+
+    messages, embed_texts = themed_messages
+    event_model = EventDetection(mode="fast", models_dir=str(tmp_path))
+    monkeypatch.setattr(event_model, "_embed_texts", embed_texts)
+    [(topic_info, topics)] = event_model._cluster_objects(
+        [("road", 1, messages.iloc[:60])], 3
+    )
+    assert topic_info.Topic.tolist() == sorted(set(topics))
+    assert (
+        topic_info.Name.str.split("_").str[0].astype(int) == topic_info.Topic
+    ).all()
+    assert (
+        "topic_mapping"
+        in json.loads((tmp_path / "manifest.json").read_text())["road/1"]
+    )
+    query_model = EventDetection(mode="fast", models_dir=str(tmp_path))
+    monkeypatch.setattr(query_model, "_embed_texts", embed_texts)
+    classified = query_model.classify(
+        messages.text.iloc[:60].tolist(), "road", 1
+    )
+    assert set(classified.topic) <= set(topic_info.Topic)
+
+
+def test_duplicates_collapsed_and_expanded(themed_messages, monkeypatch):
+    messages, embed_texts = themed_messages
+    campaign = pd.DataFrame(
+        {"message_id": range(75, 95), "text": ["яма на дороге дом 0"] * 20}
+    )
+    messages = pd.concat([messages.iloc[:45], campaign], ignore_index=True)
+    event_model = EventDetection(dedup_threshold=0.8)
+    monkeypatch.setattr(event_model, "_embed_texts", embed_texts)
+    messages = event_model._mark_duplicates(messages)
+    clustered = []
+    cluster_objects = event_model._cluster_objects
+
+    def count_clustered(objects, min_event_size):
+        clustered.extend(
+            len(local_messages) for _, _, local_messages in objects
+        )
+        return cluster_objects(objects, min_event_size)
+
+    monkeypatch.setattr(event_model, "_cluster_objects", count_clustered)
+    event_model._fit_objects([("road", 1, messages)], 3)
+    # every group of near duplicates is clustered as at most 5 copies
+    sizes = messages.duplicate_group.value_counts()
+    assert clustered == [sizes.clip(upper=5).sum()] and clustered[0] < 65
+    assert event_model.instrumentation.counters["duplicates_collapsed"] == (
+        65 - clustered[0]
+    )
+    topic_info, message_ids, topics = event_model.object_clusters[("road", 1)]
+    assert message_ids == messages.message_id.tolist()
+    assert topic_info.Count.sum() == len(topics) == 65
+    groups = messages.duplicate_group.tolist()
+    assert len({(group, topic) for group, topic in zip(groups, topics)}) == len(
+        sizes
+    )
+
+
+def test_probability_free_clustering(themed_messages, monkeypatch):
+    messages, embed_texts = themed_messages
+
+    def not_called(*args, **kwargs):
+        raise AssertionError("topics should not be refitted")
+
+    monkeypatch.setattr(BERTopic, "approximate_distribution", not_called)
+    monkeypatch.setattr(BERTopic, "update_topics", not_called)
+    event_model = EventDetection(probability_free=True)
+    monkeypatch.setattr(event_model, "_embed_texts", embed_texts)
+    [(topic_info, topics)] = event_model._cluster_objects(
+        [("road", 1, messages)], 3
+    )
+    assert -1 not in topics
+    assert topic_info.Count.sum() == len(topics) == 75
+    assert set(topic_info.Topic) == set(topics)
+    assert {"Name", "Representative_Docs", "Count"} <= set(topic_info.columns)
@@ -0,0 +1,52 @@
+import json
+
+import pandas as pd
+
+from factfinder import Instrumentation
+
+
+def test_stage_records_and_report(tmp_path):
+    records = []
+    instrumentation = Instrumentation(hooks=[records.append])
+    with instrumentation.stage("events", messages=3) as record:
+        sum(range(100000))
+        record["events"] = 2
+    instrumentation.count("ner_calls")
+    instrumentation.count("ner_calls", 2)
+    instrumentation.object_timings = [
+        {"level": "link", "object_id": str(i), "texts": i, "seconds": i / 10}
+        for i in range(5)
+    ]
+
+    assert records == instrumentation.stages
+    [record] = records
+    assert record["stage"] == "events"
+    assert (record["messages"], record["events"]) == (3, 2)
+    assert record["wall_time"] > 0 and record["cpu_time"] >= 0
+    assert record["peak_rss_mb"] >= record["peak_rss_growth_mb"] >= 0
+
+    report = instrumentation.report(str(tmp_path / "report.json"), slowest=2)
+    assert report["counters"] == {"ner_calls": 3}
+    assert [x["object_id"] for x in report["slowest_objects"]] == ["4", "3"]
+    assert json.loads((tmp_path / "report.json").read_text()) == report
+
+    instrumentation.report(str(tmp_path / "report.csv"))
+    stages = pd.read_csv(tmp_path / "report.csv")
+    assert stages.stage.tolist() == ["events"]
+
+
+def test_merge_worker_instrumentation():
+    instrumentation = Instrumentation()
+    instrumentation.count("texts_embedded", 2)
+    window = Instrumentation()
+    with window.stage("events"):
+        pass
+    window.count("texts_embedded", 3)
+    window.object_timings.append({"level": "link", "seconds": 1.0})
+
+    instrumentation.merge(window, window=4)
+    assert instrumentation.counters == {"texts_embedded": 5}
+    assert instrumentation.object_timings == window.object_timings
+    [record] = instrumentation.stages
+    assert (record["stage"], record["window"]) == ("events", 4)
+    assert "window" not in window.stages[0]
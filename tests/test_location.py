@@ -1,6 +1,6 @@
 import pytest
 
-from factfinder.src.geocoder import Geocoder
+from factfinder.src.geocoder import Geocoder, Location
 
 # def test_geocode_with_retry(input_address, geocode_result):
 #     result = Location().geocode_with_retry(input_address)
@@ -28,4 +28,14 @@ from factfinder.src.geocoder import Geocoder
 
 def test_geolocator(input_address, geocode_result):
     result = Geocoder().extract_ner_street(input_address)
-    assert result.loc[0] == geocode_result
\ No newline at end of file
+    assert result.loc[0] == geocode_result
+
+
+def test_location_counts_requests_and_cache_hits(monkeypatch):
+    location = Location()
+    monkeypatch.setattr(
+        location.geolocator, "geocode", lambda *args, **kwargs: "found"
+    )
+    assert location.query("Итальянская 17") == "found"
+    assert location.query("Итальянская 17") == "found"
+    assert (location.requests, location.cache_hits) == (1, 1)
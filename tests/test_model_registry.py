@@ -0,0 +1,41 @@
+import pickle
+
+import torch
+
+from factfinder import ModelRegistry
+from factfinder.src.model_registry import _model_size_mb
+
+
+def test_registry_shares_models_and_evicts_least_recently_used():
+    registry = ModelRegistry(memory_budget_mb=1)
+    loads = []
+
+    def loader(n):
+        def load():
+            loads.append(n)
+            # 128 x 1024 float32 weights make 0.5 MB
+            return torch.nn.Linear(1024, 128, bias=False)
+
+        return load
+
+    first = registry.get("a", loader("a"))
+    assert registry.get("a", loader("a")) is first
+    assert _model_size_mb(first) == 0.5
+    registry.get("b", loader("b"), device="cpu")
+    registry.get("a", loader("a"))
+    registry.get("c", loader("c"))
+    assert loads == ["a", "b", "c"]
+    # "b" was used least recently, so it is dropped to fit the budget
+    assert [x["repository_id"] for x in registry.loaded()] == ["a", "c"]
+    assert (registry.hits, registry.misses, registry.evictions) == (2, 3, 1)
+    assert registry.get("b", loader("b"), device="cpu") is not None
+    assert loads == ["a", "b", "c", "b"]
+
+
+def test_registry_arrives_empty_in_other_processes():
+    registry = ModelRegistry(memory_budget_mb=10)
+    registry.get("a", lambda: torch.nn.Linear(4, 4))
+    copied = pickle.loads(pickle.dumps(registry))
+    assert copied.memory_budget_mb == 10
+    assert copied.loaded() == []
+    assert len(registry.loaded()) == 1
@@ -0,0 +1,209 @@
+import pytest
+import shapely
+
+from factfinder import EventDetection
+from factfinder.src import osm
+from factfinder.src.geocoder import Streets
+from factfinder.src.osm import OsmExtract
+
+
+@pytest.fixture
+def extract(tmp_path, monkeypatch):
+    path = tmp_path / "city.osm.pbf"
+    path.write_bytes(b"pbf")
+    boundary = shapely.box(30.0, 59.0, 31.0, 60.0)
+    district = shapely.box(30.0, 59.0, 30.5, 60.0)
+    ways = [
+        # two streets crossing at node 2, a footway and a road outside
+        (
+            "Садовая улица",
+            "residential",
+            True,
+            [1, 2, 3],
+            [(30.1, 59.5), (30.2, 59.5), (30.3, 59.5)],
+        ),
+        (
+            "Невский проспект",
+            "primary",
+            True,
+            [4, 2, 5],
+            [(30.2, 59.4), (30.2, 59.5), (30.2, 59.6)],
+        ),
+        (
+            "Пешеходная улица",
+            "pedestrian",
+            False,
+            [6, 7],
+            [(30.6, 59.5), (30.7, 59.5)],
+        ),
+        (
+            "Загородное шоссе",
+            "trunk",
+            True,
+            [8, 9],
+            [(32.0, 59.5), (32.1, 59.5)],
+        ),
+    ]
+    scans = []
+
+    def scan(city_name):
+        scans.append(city_name)
+        return [
+            ("4", shapely.to_wkb(boundary, hex=True)),
+            ("5", shapely.to_wkb(district, hex=True)),
+        ], ways
+
+    extract = OsmExtract(str(path), cache_dir=str(tmp_path / "cache"))
+    monkeypatch.setattr(extract, "_scan", scan)
+    return extract, scans
+
+
+def test_osm_extract_road_links_and_names(extract):
+    extract, scans = extract
+    links = extract.road_links("Санкт-Петербург", 32636)
+    assert len(links) == 4
+    assert links.crs.to_epsg() == 32636
+    assert links.groupby("name").size().to_dict() == {
+        "Невский проспект": 2,
+        "Садовая улица": 2,
+    }
+    assert links.road_id.nunique() == 2
+
+    assert (
+        extract.boundary("Санкт-Петербург", 5).geometry.iloc[0].bounds[2]
+        == 30.5
+    )
+    # a level without boundaries falls back to the city itself
+    assert (
+        extract.boundary("Санкт-Петербург", 8).geometry.iloc[0].bounds[2]
+        == 31.0
+    )
+    names = Streets.run(
+        "Санкт-Петербург", 8, names_only=True, osm_extract=extract
+    )
+    assert names.street.tolist() == [
+        "Садовая улица",
+        "Невский проспект",
+        "Пешеходная улица",
+    ]
+    drive_names = Streets.run("Санкт-Петербург", 5, osm_extract=extract)
+    assert drive_names.street_name.tolist() == ["садовая", "невский"]
+    assert scans == ["Санкт-Петербург"]
+
+
+def test_osm_extract_cache(extract, monkeypatch):
+    extract, scans = extract
+    extract.boundary("Санкт-Петербург")
+    cached = OsmExtract(extract.path, cache_dir=extract.cache_dir)
+    segments = cached.segments("Санкт-Петербург")
+    assert scans == ["Санкт-Петербург"]
+    assert len(segments) == 5
+    monkeypatch.setattr(osm, "osmium", None)
+    with pytest.raises(ImportError):
+        OsmExtract(extract.path)._city("Москва")
+
+
+def test_event_detection_reads_roads_from_extract(extract):
+    extract, _ = extract
+    event_model = EventDetection(osm_pbf=extract.path, offline=True)
+    event_model.osm_extract = extract
+    links = event_model._get_roads("Санкт-Петербург", 32636)
+    assert links.columns.tolist() == ["link_id", "name", "geometry", "road_id"]
+    assert len(links) == 4
+
+
+def osm_xml(nodes, ways, relations):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6">']
+    for node_id, (lon, lat) in nodes.items():
+        lines.append(
+            f'<node id="{node_id}" version="1" lat="{lat}" lon="{lon}"/>'
+        )
+    for way_id, (refs, tags) in ways.items():
+        lines.append(f'<way id="{way_id}" version="1">')
+        lines.extend(f'<nd ref="{ref}"/>' for ref in refs)
+        lines.extend(f'<tag k="{k}" v="{v}"/>' for k, v in tags.items())
+        lines.append("</way>")
+    for relation_id, (outer, tags) in relations.items():
+        lines.append(f'<relation id="{relation_id}" version="1">')
+        lines.append(f'<member type="way" ref="{outer}" role="outer"/>')
+        lines.extend(f'<tag k="{k}" v="{v}"/>' for k, v in tags.items())
+        lines.append("</relation>")
+    lines.append("</osm>")
+    return "\n".join(lines)
+
+
+@pytest.fixture
+def osm_file(tmp_path):
+    pytest.importorskip("osmium")
+    nodes = {
+        # boundaries of two cities, the second one without highways
+        1: (30.0, 59.0),
+        2: (30.5, 59.0),
+        3: (30.5, 59.5),
+        4: (30.0, 59.5),
+        5: (33.0, 59.0),
+        6: (33.1, 59.0),
+        7: (33.1, 59.1),
+        # two streets crossing at node 11, a footway and a square
+        10: (30.1, 59.2),
+        11: (30.2, 59.2),
+        12: (30.3, 59.2),
+        13: (30.2, 59.1),
+        14: (30.2, 59.3),
+        15: (30.35, 59.4),
+        16: (30.45, 59.4),
+        17: (30.1, 59.4),
+        18: (30.12, 59.4),
+        19: (30.12, 59.42),
+        # a highway far outside both cities
+        20: (35.0, 59.2),
+        21: (35.1, 59.2),
+    }
+    city = {"type": "boundary", "boundary": "administrative"}
+    ways = {
+        100: ([1, 2, 3, 4, 1], {}),
+        101: ([5, 6, 7, 5], {}),
+        200: ([10, 11, 12], {"highway": "residential", "name": "Садовая"}),
+        201: ([13, 11, 14], {"highway": "primary", "name": "Невский"}),
+        202: ([15, 16], {"highway": "pedestrian", "name": "Пешеходная"}),
+        203: ([17, 18, 19, 17], {"place": "square", "name": "Сенная"}),
+        204: ([20, 21], {"highway": "trunk", "name": "Загородное"}),
+    }
+    relations = {
+        1000: (100, {**city, "admin_level": "8", "name": "Тестоград"}),
+        1001: (101, {**city, "admin_level": "8", "name": "Пустоград"}),
+    }
+    path = tmp_path / "city.osm"
+    path.write_text(osm_xml(nodes, ways, relations), encoding="utf-8")
+    return str(path)
+
+
+def test_osm_extract_reads_file(osm_file):
+    extract = OsmExtract(osm_file)
+    _, ways = extract._scan("Тестоград")
+    # ways outside the bounding box of the city are not kept
+    assert sorted(way[0] for way in ways) == [
+        "Невский",
+        "Пешеходная",
+        "Садовая",
+        "Сенная",
+    ]
+    boundary = extract.boundary("Тестоград").geometry.iloc[0]
+    assert boundary.area == pytest.approx(0.25)
+    links = extract.road_links("Тестоград", 32636)
+    assert links.groupby("name").size().to_dict() == {
+        "Невский": 2,
+        "Садовая": 2,
+    }
+    names = Streets.run("Тестоград", 8, names_only=True, osm_extract=extract)
+    assert sorted(names.street) == [
+        "Невский",
+        "Пешеходная",
+        "Садовая",
+        "Сенная",
+    ]
+
+    assert extract.segments("Пустоград").empty
+    assert extract.road_links("Пустоград", 32636).empty
+    with pytest.raises(ValueError):
+        extract.segments("Москва")
@@ -0,0 +1,128 @@
+import pandas as pd
+import pytest
+
+from factfinder import CascadeModel, Pipeline
+
+calls = []
+
+
+class FakeClassifier:
+    def __init__(self, repository_id="classifier/v1"):
+        self.repository_id = repository_id
+
+    def run(self, text):
+        calls.append("classification")
+        return [f"{self.repository_id}:{len(text)}", "0.9"]
+
+
+class FakeGeocoder:
+    def __init__(self, model_path="ner/v1"):
+        pass
+
+    def run(self, df, text_column):
+        calls.append("geocoding")
+        df = df.reset_index(drop=False)
+        df["Street"] = df[text_column].str.split().str[0]
+        return df
+
+
+class FakeEventDetection:
+    def __init__(self, n_jobs=1):
+        pass
+
+    def run(self, messages, population, city_name, city_crs, min_event_size):
+        calls.append("events")
+        return messages, min_event_size
+
+
+class FakeCascadeClassifier(FakeClassifier):
+    def __init__(self, repository_id="classifier/v1", cascade=None):
+        super().__init__(repository_id)
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        Pipeline,
+        "components",
+        {
+            "classification": FakeClassifier,
+            "geocoding": FakeGeocoder,
+            "events": FakeEventDetection,
+        },
+    )
+    calls.clear()
+    population = tmp_path / "population.geojson"
+    population.write_text("{}")
+    return tmp_path, str(population)
+
+
+def test_pipeline_reruns_only_invalidated_stages(pipeline):
+    cache_dir, population = pipeline
+    df = pd.DataFrame({"Текст комментария": ["Невский 1", "Садовая 2"]})
+
+    messages, _ = Pipeline(str(cache_dir)).run(df, population, "city", 1, 3)
+    assert sorted(set(calls)) == ["classification", "events", "geocoding"]
+    assert messages.message_id.tolist() == [0, 1]
+    assert messages.cats.tolist() == ["classifier/v1:9", "classifier/v1:9"]
+    assert messages.Street.tolist() == ["Невский", "Садовая"]
+
+    calls.clear()
+    Pipeline(str(cache_dir)).run(df, population, "city", 1, 3)
+    assert calls == []
+
+    _, min_event_size = Pipeline(str(cache_dir)).run(
+        df, population, "city", 1, 5
+    )
+    assert calls == ["events"] and min_event_size == 5
+
+    calls.clear()
+    Pipeline(str(cache_dir), event_params={"n_jobs": 4}).run(
+        df, population, "city", 1, 5
+    )
+    assert calls == []
+
+    pipeline_v2 = Pipeline(
+        str(cache_dir), classifier_params={"repository_id": "classifier/v2"}
+    )
+    messages, _ = pipeline_v2.run(df, population, "city", 1, 5)
+    assert sorted(set(calls)) == ["classification", "events"]
+    assert messages.cats.str.startswith("classifier/v2").all()
+    cached = {
+        record["stage"]: record["cached"]
+        for record in pipeline_v2.instrumentation.stages
+    }
+    assert cached == {
+        "classification": False,
+        "geocoding": True,
+        "events": False,
+    }
+
+
+def test_pipeline_hashes_cascade_content(pipeline, monkeypatch):
+    cache_dir, _ = pipeline
+    monkeypatch.setitem(
+        Pipeline.components, "classification", FakeCascadeClassifier
+    )
+    df = pd.DataFrame({"Текст комментария": ["Невский 1", "Садовая 2"]})
+
+    def cascade(labels):
+        texts = ["яма на дороге", "мусор во дворе"]
+        return CascadeModel(n_features=2**10).fit(texts, labels)
+
+    # equal models are different objects, e.g. in another process
+    for expected in [["classification", "classification"], []]:
+        calls.clear()
+        Pipeline(
+            str(cache_dir), classifier_params={"cascade": cascade(["a", "b"])}
+        ).prepare(df)
+        assert [call for call in calls if call != "geocoding"] == expected
+
+    path = str(cache_dir / "cascade.joblib")
+    cascade(["a", "b"]).save(path)
+    Pipeline(str(cache_dir), classifier_params={"cascade": path}).prepare(df)
+    calls.clear()
+    # the model is refitted at the same path
+    cascade(["b", "a"]).save(path)
+    Pipeline(str(cache_dir), classifier_params={"cascade": path}).prepare(df)
+    assert "classification" in calls
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from factfinder import MicroBatcher
+
+
+def test_micro_batcher_batches_requests_and_keeps_order():
+    batches = []
+
+    def batch_fn(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    async def serve():
+        async with MicroBatcher(batch_fn, max_batch_size=4, max_wait=0.05) as b:
+            results = await asyncio.gather(*[b.submit(i) for i in range(10)])
+            return results, b.stats()
+
+    results, stats = asyncio.run(serve())
+    assert results == [i * 2 for i in range(10)]
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert stats["queue_depth"] == 0
+    assert (stats["batches"], stats["items"]) == (3, 10)
+    assert stats["latency_max"] >= stats["latency_p50"] > 0
+
+
+def test_micro_batcher_passes_errors_to_callers():
+    def batch_fn(items):
+        raise RuntimeError("model failed")
+
+    async def serve():
+        async with MicroBatcher(batch_fn, max_wait=0.01) as b:
+            with pytest.raises(RuntimeError):
+                await b.submit("text")
+            return b.stats()
+
+    assert asyncio.run(serve())["items"] == 1
+
+
+def test_micro_batcher_survives_wrong_number_of_results():
+    def batch_fn(items):
+        return [item for item in items if item != "dropped"]
+
+    async def serve():
+        async with MicroBatcher(batch_fn, max_wait=0.05) as b:
+            results = await asyncio.gather(
+                b.submit("kept"), b.submit("dropped"), return_exceptions=True
+            )
+            return results, await b.submit("next"), b.stats()
+
+    results, next_result, stats = asyncio.run(serve())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert next_result == "next"
+    assert (stats["batches"], stats["items"]) == (2, 3)
@@ -0,0 +1,91 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pandas as pd
+import pytest
+
+from factfinder import Pipeline, ShardedRun
+
+from .test_pipeline import FakeClassifier, FakeEventDetection, FakeGeocoder
+
+
+@pytest.fixture
+def texts():
+    return pd.DataFrame(
+        {
+            "Текст комментария": [f"Улица {i} дом {i % 4}" for i in range(12)],
+            "district": ["Центральный", "Адмиралтейский", "Невский"] * 4,
+        }
+    )
+
+
+def make_pipeline(cache_dir):
+    pipeline = Pipeline(str(cache_dir))
+    pipeline.components = {
+        "classification": FakeClassifier,
+        "geocoding": FakeGeocoder,
+        "events": FakeEventDetection,
+    }
+    return pipeline
+
+
+@pytest.mark.parametrize(
+    "shard_key, n_jobs", [("district", 1), (None, 1), (None, 2)]
+)
+def test_sharded_run_matches_single_run(tmp_path, texts, shard_key, n_jobs):
+    expected, _ = make_pipeline(tmp_path / "cache").prepare(texts)
+    sharded = ShardedRun(make_pipeline(tmp_path / "cache"), tmp_path / "shards")
+    messages = sharded.run(texts, shard_key, n_shards=4, n_jobs=n_jobs)
+    columns = ["message_id", "Текст комментария", "Street", "cats"]
+    pd.testing.assert_frame_equal(messages[columns], expected[columns])
+    assert sharded.pending() == []
+    with pytest.raises(FileExistsError):
+        sharded.split(texts)
+
+
+def test_merge_requires_all_shards(tmp_path, texts):
+    sharded = ShardedRun(make_pipeline(tmp_path / "cache"), tmp_path / "shards")
+    shards = sharded.split(texts, "district")
+    assert len(shards) == 3
+    assert sharded.process(shards[0])
+    assert not sharded.process(shards[0])
+    with pytest.raises(RuntimeError):
+        sharded.merge()
+
+
+def test_stale_locks_are_taken_over(tmp_path, texts):
+    sharded = ShardedRun(
+        make_pipeline(tmp_path / "cache"), tmp_path / "shards", lock_timeout=60
+    )
+    shards = sharded.split(texts, "district")
+    # a crashed worker of this host, an old and a fresh one of another host
+    worker = subprocess.Popen([sys.executable, "-c", "pass"])
+    worker.wait()
+    locks = [
+        {"host": socket.gethostname(), "pid": worker.pid, "time": time.time()},
+        {"host": "other", "pid": 1, "time": time.time() - 120},
+        {"host": "other", "pid": 1, "time": time.time()},
+    ]
+    for shard, lock in zip(shards, locks):
+        path = tmp_path / "shards" / "shards" / shard / "lock"
+        path.write_text(json.dumps(lock))
+    assert sharded.pending() == shards[:2]
+
+    assert sharded.work() == 2
+    assert sharded.pending() == []
+    lock = json.loads(path.with_name("lock").read_text())
+    assert lock == locks[2]
+    assert not sharded.process(shards[2])
+    with pytest.raises(RuntimeError):
+        sharded.merge()
+    taken = tmp_path / "shards" / "shards" / shards[1] / "lock"
+    assert json.loads(taken.read_text())["pid"] == os.getpid()
+
+    # the last worker crashed as well, its lock is released explicitly
+    path.write_text(json.dumps({**locks[2], "time": time.time() - 120}))
+    assert sharded.release_stale() == [shards[2]]
+    assert sharded.pending() == [shards[2]]
@@ -0,0 +1,81 @@
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from shapely import LineString, Point, box
+
+from factfinder.src import storage
+from factfinder.src.storage import read_layer, read_outputs, write_outputs
+
+
+def test_outputs_round_trip_with_list_columns(tmp_path):
+    messages = gpd.GeoDataFrame(
+        {"message_id": [1, 2, 3], "text": ["a", "b", "c"]},
+        geometry=[Point(30.3, 59.9)] * 3,
+        crs=4326,
+    )
+    events = gpd.GeoDataFrame(
+        {
+            "id": ["0_road_1", "1_road_1"],
+            "message_ids": [[1, 2, 3], []],
+            "docs": [[1, 3], []],
+        },
+        geometry=[Point(30.3, 59.9), Point(30.31, 59.91)],
+        crs=4326,
+    )
+    connections = gpd.GeoDataFrame(
+        {"a": ["0_road_1"], "b": ["1_road_1"], "weight": [1]},
+        geometry=[LineString([(30.3, 59.9), (30.31, 59.91)])],
+        crs=4326,
+    )
+    write_outputs(str(tmp_path), messages, events, connections, prefix="x_")
+
+    schema = pq.read_schema(tmp_path / "x_events.parquet")
+    assert schema.field("message_ids").type == pa.list_(pa.int64())
+    assert schema.field("docs").type == pa.list_(pa.int64())
+    messages_read, events_read, connections_read = read_outputs(
+        str(tmp_path), prefix="x_"
+    )
+    assert events_read.message_ids.tolist() == [[1, 2, 3], []]
+    assert events_read.docs.tolist() == [[1, 3], []]
+    assert events_read.crs == events.crs
+    assert connections_read.geometry.equals(connections.geometry)
+    assert messages_read.message_id.tolist() == [1, 2, 3]
+
+
+@pytest.mark.parametrize("suffix", [".geojson", ".gpkg", ".parquet"])
+@pytest.mark.parametrize("use_pyogrio", [True, False])
+def test_read_layer_projects_columns_and_clips(
+    tmp_path, monkeypatch, suffix, use_pyogrio
+):
+    if use_pyogrio and storage.pyogrio is None:
+        pytest.skip("pyogrio is not installed")
+    if not use_pyogrio and suffix != ".parquet":
+        pytest.importorskip("fiona")
+        monkeypatch.setattr(storage, "pyogrio", None)
+    layer = gpd.GeoDataFrame(
+        {
+            "address": ["a", "b", "c"],
+            "population_balanced": [10, 20, 30],
+            "unused": [1, 2, 3],
+        },
+        geometry=[Point(30.3, 59.9), Point(30.5, 59.9), Point(30.31, 59.91)],
+        crs=4326,
+    )
+    path = str(tmp_path / f"buildings{suffix}")
+    if suffix == ".parquet":
+        layer.to_parquet(path)
+    else:
+        layer.to_file(path)
+    columns = ["address", "population_balanced"]
+
+    full = read_layer(path, columns)
+    assert list(full.columns) == [*columns, "geometry"]
+    assert full.address.tolist() == ["a", "b", "c"]
+
+    bbox = gpd.GeoSeries([box(30.29, 59.89, 30.32, 59.92)], crs=4326)
+    clipped = read_layer(path, columns, bbox.to_crs(32636))
+    assert clipped.address.tolist() == ["a", "c"]
+    assert clipped.crs == layer.crs
+    if use_pyogrio or suffix == ".parquet":
+        assert clipped.index.tolist() == full.index[[0, 2]].tolist()
@@ -1,5 +1,7 @@
 import geopandas as gpd
+import networkx as nx
 
+from factfinder.src import geocoder
 from factfinder.src.geocoder import Streets
 
 
@@ -8,3 +10,50 @@ def test_get_city_bounds():
     assert isinstance(result, gpd.GeoDataFrame)
     assert result.shape[0] != 0
     assert result.shape[1] == 4
+
+
+def test_named_ways_names_only(monkeypatch):
+    queries = []
+
+    class Response:
+        def json(self):
+            return {
+                "elements": [
+                    {"type": "way", "id": 1, "tags": {"name": "Садовая улица"}},
+                    {
+                        "type": "way",
+                        "id": 2,
+                        "tags": {"name": " Невский проспект"},
+                    },
+                    {"type": "way", "id": 3, "tags": {"name": "Садовая улица"}},
+                    {
+                        "type": "way",
+                        "id": 4,
+                        "tags": {"name": "Дворцовая площадь"},
+                    },
+                ]
+            }
+
+    def get(url, params):
+        queries.append(params["data"])
+        return Response()
+
+    monkeypatch.setattr(geocoder.requests, "get", get)
+    streets = Streets.run("Санкт-Петербург", 5, names_only=True)
+    assert "out tags;" in queries[0]
+    assert streets.street.tolist() == [
+        "Садовая улица",
+        "Невский проспект",
+        "Дворцовая площадь",
+    ]
+    assert streets.street_name.tolist() == ["садовая", "невский", "дворцовая"]
+
+
+def test_graph_to_gdf_drops_unnamed_edges():
+    graph = nx.MultiDiGraph(crs="epsg:4326")
+    for node, x in enumerate([30.30, 30.31, 30.32]):
+        graph.add_node(node, x=x, y=59.9)
+    graph.add_edge(0, 1, name="Садовая улица", length=500.0)
+    graph.add_edge(1, 2, length=500.0)
+    gdf = Streets.graph_to_gdf(graph)
+    assert gdf.name.tolist() == ["Садовая улица"]